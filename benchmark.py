@@ -0,0 +1,220 @@
+# -*- coding: utf-8 *-*
+"""
+Benchmark suite for mendeley2bib.
+
+Generates synthetic Mendeley Desktop databases of configurable size, times the separate stages of an export on them
+and writes the results to a JSON report, so that performance can be compared between versions:
+
+    python benchmark.py -n 1000 10000 100000 -o report.json
+"""
+from __future__ import unicode_literals
+import os
+import json
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import platform
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+from exporter import Mendeley2Bib
+import latex
+
+log = logging.getLogger(__name__)
+
+# Subset of the Mendeley Desktop schema that mendeley2bib reads from
+schema = [
+    """CREATE TABLE Documents (id INTEGER PRIMARY KEY AUTOINCREMENT, uuid VARCHAR NOT NULL UNIQUE, confirmed VARCHAR,
+        deduplicated VARCHAR, deletionPending VARCHAR, favourite VARCHAR, read VARCHAR, type VARCHAR, title VARCHAR,
+        added INT, modified INT, importer VARCHAR, note VARCHAR, privacy VARCHAR, abstract VARCHAR, advisor VARCHAR,
+        applicationNumber VARCHAR, articleColumn VARCHAR, arxivId VARCHAR, chapter VARCHAR, citationKey VARCHAR,
+        city VARCHAR, code VARCHAR, codeNumber VARCHAR, codeSection VARCHAR, codeVolume VARCHAR, committee VARCHAR,
+        counsel VARCHAR, country VARCHAR, dateAccessed VARCHAR, department VARCHAR, doi VARCHAR, edition VARCHAR,
+        genre VARCHAR, institution VARCHAR, internationalAuthor VARCHAR, internationalNumber VARCHAR,
+        internationalTitle VARCHAR, internationalUserType VARCHAR, isbn VARCHAR, issn VARCHAR, issue VARCHAR,
+        language VARCHAR, lastUpdate VARCHAR, legalStatus VARCHAR, length VARCHAR, medium VARCHAR, month INT,
+        originalPublication VARCHAR, owner VARCHAR, pages VARCHAR, pmid BIGINT, publication VARCHAR,
+        publicLawNumber VARCHAR, publisher VARCHAR, reprintEdition VARCHAR, reviewedArticle VARCHAR,
+        revisionNumber VARCHAR, sections VARCHAR, seriesEditor VARCHAR, series VARCHAR, seriesNumber VARCHAR,
+        session VARCHAR, shortTitle VARCHAR, sourceType VARCHAR, userType VARCHAR, volume VARCHAR, year INT, day INT)""",
+    """CREATE TABLE DocumentContributors (id INTEGER PRIMARY KEY AUTOINCREMENT, documentId INTEGER NOT NULL,
+        contribution VARCHAR NOT NULL, firstNames VARCHAR, lastName VARCHAR NOT NULL)""",
+    "CREATE INDEX DocumentContributors_DocumentIdIndex ON DocumentContributors (documentId)",
+    "CREATE TABLE DocumentTags (documentId INTEGER NOT NULL, tag VARCHAR NOT NULL, PRIMARY KEY (documentId, tag))",
+    "CREATE TABLE DocumentKeywords (documentId INTEGER NOT NULL, keyword VARCHAR NOT NULL, PRIMARY KEY (documentId, keyword))",
+    "CREATE TABLE DocumentUrls (documentId INTEGER NOT NULL, position INTEGER NOT NULL, url VARCHAR NOT NULL, PRIMARY KEY (documentId, position))",
+    "CREATE TABLE DocumentFolders (documentId INTEGER NOT NULL, folderId INTEGER NOT NULL, status VARCHAR NOT NULL, PRIMARY KEY (documentId, folderId))",
+    """CREATE TABLE Folders (id INTEGER PRIMARY KEY AUTOINCREMENT, uuid VARCHAR UNIQUE, name VARCHAR NOT NULL,
+        parentId INT, access VARCHAR NOT NULL, syncPolicy VARCHAR, downloadFilesPolicy INT, uploadFilesPolicy INT,
+        publicUrl VARCHAR, description VARCHAR, creatorName VARCHAR, creatorProfileUrl VARCHAR)""",
+    "CREATE TABLE Groups (id INTEGER PRIMARY KEY AUTOINCREMENT, remoteId INT, remoteUuid VARCHAR UNIQUE, name VARCHAR, groupType VARCHAR NOT NULL, status VARCHAR NOT NULL, access VARCHAR NOT NULL, syncPolicy VARCHAR NOT NULL, downloadFilesPolicy INT NOT NULL, uploadFilesPolicy INT NOT NULL, publicUrl VARCHAR, isOwner BOOLEAN NOT NULL, isReadOnly BOOLEAN NOT NULL, isPrivate BOOLEAN NOT NULL, iconName VARCHAR)",
+    "CREATE TABLE RemoteDocuments (documentId INTEGER NOT NULL, remoteId INT, remoteUuid VARCHAR, groupId INT, status VARCHAR, inTrash VARCHAR, PRIMARY KEY (documentId))",
+]
+
+documentTypes = ['JournalArticle'] * 8 + ['ConferenceProceedings'] * 4 + ['Book', 'BookSection', 'Thesis', 'Report', 'WebPage', 'Generic', 'Patent', 'Bill']
+firstNames = ['A.', 'Jan', 'José', 'Zoë', 'Björn', 'Søren', 'François', 'Łukasz', 'Ana María', 'H. J.', 'Ólafur']
+lastNames = ['Smith', 'Jones', 'Müller', 'Ørsted', 'Dvořák', 'Łukasiewicz', 'García Márquez', 'van der Berg', 'Şahin', 'Nguyễn', 'Erdős', 'Ångström']
+words = ['analysis', 'of', 'the', 'efficient', 'naïve', 'algorithm', 'for', 'large', 'scale', 'résumé', 'systems', 'über',
+    'distributed', 'learning', 'with', 'noise', 'and', 'bounds', 'on', 'α-stable', 'processes', '≈', 'a', 'study', 'in']
+journals = ['Journal of Applied Things', 'Zeitschrift für Physik', 'Annales de l\'Institut Fourier', 'ACM Computing Surveys', 'Nature']
+publishers = ['Springer', 'Elsevier', 'IEEE', 'ACM', 'Wiley-VCH', 'Presses Universitaires de France']
+cities = ['Berlin', 'Zürich', 'New York', 'København', 'Kraków', 'São Paulo']
+
+def generateDatabase(filename, documents, seed=0):
+    """Fills a new sqlite file with a synthetic Mendeley Desktop library of the given number of documents."""
+    rand = random.Random(seed)
+    sentence = lambda n: ' '.join([rand.choice(words) for i in range(n)])
+    conn = sqlite3.connect(filename)
+    for statement in schema:
+        conn.execute(statement)
+    conn.execute('INSERT INTO Groups (id, name, groupType, status, access, syncPolicy, downloadFilesPolicy, uploadFilesPolicy, isOwner, isReadOnly, isPrivate) VALUES (0, \'\', \'\', \'\', \'\', \'\', 0, 0, 0, 0, 0);')
+    groups = max(1, documents // 2000)
+    for group in range(1, groups + 1):
+        conn.execute('INSERT INTO Groups (id, name, groupType, status, access, syncPolicy, downloadFilesPolicy, uploadFilesPolicy, isOwner, isReadOnly, isPrivate) VALUES (?, ?, \'Private\', \'Normal\', \'PrivateAccess\', \'SyncMetadataOnly\', 0, 0, 1, 0, 1);', [group, 'Group %d' % group])
+    # a folder tree a few levels deep
+    folders = max(3, documents // 200)
+    for folder in range(1, folders + 1):
+        parent = rand.randrange(1, folder) if folder > 3 and rand.random() < 0.7 else -1
+        conn.execute('INSERT INTO Folders (id, name, parentId, access) VALUES (?, ?, ?, \'PrivateAccess\');', [folder, '%s %d' % (rand.choice(words).capitalize(), folder), parent])
+
+    for id in range(1, documents + 1):
+        type = rand.choice(documentTypes)
+        document = {
+            'id': id,
+            'uuid': '{%08x-0000-0000-0000-%012x}' % (seed, id),
+            'deletionPending': 'true' if rand.random() < 0.01 else 'false',
+            'favourite': 'true' if rand.random() < 0.1 else 'false',
+            'type': type,
+            'title': sentence(rand.randrange(4, 16)).capitalize(),
+            'abstract': sentence(rand.randrange(100, 400)) if rand.random() < 0.8 else None,
+            'note': sentence(rand.randrange(10, 200)) if rand.random() < 0.2 else None,
+            'citationKey': None if rand.random() < 0.05 else 'key%d' % id,
+            'year': rand.randrange(1950, 2025) if rand.random() < 0.98 else None,
+            'month': rand.randrange(1, 13) if rand.random() < 0.5 else None,
+            'added': id, 'modified': id,
+            'doi': '10.%d/%d' % (rand.randrange(1000, 9999), id) if rand.random() < 0.7 else None,
+            'isbn': '978-3-16-%06d-0' % id if type in ('Book', 'BookSection') else None,
+            'issn': '%04d-%04d' % (rand.randrange(10000), rand.randrange(10000)) if type == 'JournalArticle' else None,
+            'publication': rand.choice(journals),
+            'publisher': rand.choice(publishers),
+            'city': rand.choice(cities),
+            'volume': str(rand.randrange(1, 200)),
+            'pages': '%d-%d' % (id % 900, id % 900 + rand.randrange(1, 40)),
+            'edition': '2nd' if rand.random() < 0.1 else None,
+            'institution': 'Universität %s' % rand.choice(cities) if type in ('Thesis', 'Report') else None,
+            'department': 'Department of %s' % rand.choice(words).capitalize() if type == 'Thesis' else None,
+            'userType': rand.choice(['PhD Thesis', 'Master\'s Thesis', 'Technical Report']) if rand.random() < 0.7 else None,
+            'seriesNumber': str(rand.randrange(1, 100)) if type == 'Report' else None,
+            'owner': rand.choice(lastNames) if type == 'Patent' else None,
+            'revisionNumber': str(rand.randrange(1, 10)) if type == 'Patent' else None,
+            'sourceType': 'Dataset' if type == 'Generic' else None,
+        }
+        conn.execute('INSERT INTO Documents (%s) VALUES (%s);' % (', '.join(document.keys()), ', '.join(['?'] * len(document))), list(document.values()))
+        contributors = [('DocumentAuthor', rand.choice(firstNames), rand.choice(lastNames)) for i in range(rand.choice([0, 1, 1, 2, 2, 3, 4, 8]))]
+        if type in ('Book', 'BookSection'):
+            contributors.extend([('DocumentEditor', rand.choice(firstNames), rand.choice(lastNames)) for i in range(rand.randrange(3))])
+        conn.executemany('INSERT INTO DocumentContributors (documentId, contribution, firstNames, lastName) VALUES (?, ?, ?, ?);', [[id] + list(c) for c in contributors])
+        conn.executemany('INSERT OR IGNORE INTO DocumentTags VALUES (?, ?);', [(id, rand.choice(words)) for i in range(rand.randrange(4))])
+        conn.executemany('INSERT OR IGNORE INTO DocumentKeywords VALUES (?, ?);', [(id, sentence(2)) for i in range(rand.randrange(6))])
+        conn.executemany('INSERT INTO DocumentUrls VALUES (?, ?, ?);', [(id, i, 'http://example.org/~%s/%d/%d' % (rand.choice(words), id, i)) for i in range(rand.choice([0, 0, 1, 1, 2]))])
+        conn.executemany('INSERT OR IGNORE INTO DocumentFolders VALUES (?, ?, \'Normal\');', [(id, rand.randrange(1, folders + 1)) for i in range(rand.choice([0, 1, 1, 2]))])
+        if rand.random() < 0.2:
+            conn.execute('INSERT INTO RemoteDocuments (documentId, remoteId, groupId, status, inTrash) VALUES (?, ?, ?, \'Synced\', \'false\');', [id, id, rand.randrange(1, groups + 1)])
+    conn.commit()
+    conn.close()
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    result = function(*args, **kwargs)
+    return (time.time() - start, result)
+
+def benchmarkDatabase(folder, name, jobs=1):
+    """
+    Times the stages of an export of database name in folder. Returns a dict of stage name to seconds, and a dict
+    with the number of entries read and converted and the size of the output.
+    """
+    from bibconverter import BibConverter
+    stages = {}
+    counts = {}
+    for prefetch in [False, True]:
+        mode = 'prefetch' if prefetch else 'perEntry'
+        db = Mendeley2Bib.openDatabase(name, prefetch=prefetch)
+        db.mendeleyFolder = folder
+        with db:
+            converter = BibConverter(db)
+            (stages['getEntries.%s' % mode], entries) = timed(lambda: list(db.getEntries(columns=converter.getColumns())))
+            def lookups():
+                for entry in entries:
+                    db.getDocumentContributors(entry, 'DocumentAuthor')
+                    db.getDocumentContributors(entry, 'DocumentEditor')
+                    db.getTags(entry)
+                    db.getKeywords(entry)
+                    db.getURL(entry)
+            (stages['relatedLookups.%s' % mode], result) = timed(lookups)
+            (stages['convertEntries.%s' % mode], (count, output)) = timed(converter.convertEntries, entries)
+            if prefetch:
+                values = [value for entry in entries for (column, value) in entry.items() if isinstance(value, str)]
+                (stages['latexEncode'], result) = timed(lambda: [latex.latex_encode(value) for value in values])
+                # a fresh converter, as convertEntries has already filled the cache of this one
+                encode = BibConverter(db).encode
+                (stages['latexEncode.cached'], result) = timed(lambda: [encode(value) for value in values])
+                encoded = [latex.latex_encode(value) for value in values]
+                (stages['latexDecode'], result) = timed(lambda: [latex.latex_decode(value) for value in encoded])
+                if jobs > 1:
+                    (stages['convertEntries.jobs%d' % jobs], result) = timed(BibConverter(db).convertEntries, entries, jobs)
+                counts['entries'] = len(entries)
+                counts['converted'] = count
+                counts['outputBytes'] = len(output.encode('utf-8'))
+    return (stages, counts)
+
+def getRevision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.STDOUT).decode('ASCII').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__=='__main__':
+    argparser = ArgumentParser(description='Benchmark mendeley2bib on synthetic Mendeley Desktop databases')
+    argparser.add_argument('-n', '--documents', metavar='N', type=int, nargs='+', default=[1000, 10000], help='The library sizes to benchmark (default: 1000 10000)')
+    argparser.add_argument('-o', '--output', metavar='FILE', default=None, help='Write the JSON report to FILE in stead of stdout')
+    argparser.add_argument('-j', '--jobs', metavar='N', type=int, default=1, help='Also time conversion using N worker processes')
+    argparser.add_argument('--seed', type=int, default=0, help='Random seed for the generated libraries')
+    argparser.add_argument('--keep', metavar='FOLDER', default=None, help='Generate the databases in FOLDER and keep them, in stead of using a temporary folder')
+    argparser.add_argument('-v', '--verbose', dest='loglevel', action='store_const', const=logging.INFO, default=logging.ERROR, help='Show progress and the warnings of the exporter')
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=args.loglevel, format='%(levelname)s: %(message)s')
+
+    folder = args.keep or tempfile.mkdtemp(prefix='mendeley2bib-benchmark-')
+    report = {
+        'revision': getRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlite': sqlite3.sqlite_version,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': [],
+    }
+    try:
+        for documents in args.documents:
+            name = 'benchmark%d' % documents
+            filename = os.path.join(folder, '%s@www.mendeley.com.sqlite' % name)
+            if not os.path.exists(filename):
+                log.info('Generating a library of %d documents' % documents)
+                generateDatabase(filename, documents, args.seed)
+            log.info('Benchmarking a library of %d documents' % documents)
+            result = {'documents': documents, 'databaseBytes': os.path.getsize(filename)}
+            (result['stages'], counts) = benchmarkDatabase(folder, name, args.jobs)
+            result.update(counts)
+            report['results'].append(result)
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
@@ -1,13 +1,12 @@
 # -*- coding: utf-8 *-*
-from mendeley2bib import MendeleyEntryConverter
+from exporter import MendeleyEntryConverter
 from textwrap import dedent
+from functools import lru_cache
 import latex
 import logging
 
 log = logging.getLogger(__name__)
 
-latex.register()
-
 # A converter that outputs a biblatex-compatible .bib
 class BibConverter(MendeleyEntryConverter):
     entryTemplate = dedent("""
@@ -17,9 +16,45 @@ class BibConverter(MendeleyEntryConverter):
     """)
     entryMemberSeparator = ",\n"
     entryMemberTemplate = "    $key = $value"
-
-    def __init__(self, database):
-        MendeleyEntryConverter.__init__(self, database)
+    # Documents columns and related tables read by the functions below, per output key. When adding a function to
+    # commonEntries or entryMap, declare what it reads here, or else all columns and tables are read.
+    functionColumns = {
+        'author': [],
+        'editor': [],
+        'title': ['title'],
+        'month': ['month'],
+        'pages': ['pages'],
+        'type': ['userType'],
+        'keywords': [],
+        'mendeley-tags': [],
+        'url': [],
+        'howpublished': [],
+    }
+    functionTables = {
+        'author': ['DocumentContributors'],
+        'editor': ['DocumentContributors'],
+        'title': [],
+        'month': [],
+        'pages': [],
+        'type': [],
+        'keywords': ['DocumentKeywords'],
+        'mendeley-tags': ['DocumentTags'],
+        'url': ['DocumentUrls'],
+        'howpublished': ['DocumentUrls'],
+    }
+
+    def __init__(self, database, encodingCacheSize=4096, utf8=False, includeFields=None, excludeFields=None):
+        """
+        By default, all non-ASCII characters are written as LaTeX commands. With utf8, they are kept as they are, and
+        only % # & are escaped, leaving LaTeX markup as it is; the output is then meant to be written as UTF-8, for biber.
+        """
+        MendeleyEntryConverter.__init__(self, database, includeFields, excludeFields)
+        latex.register()
+        self.counters['entries.missingUserType'] = 0
+        self.options = {'encodingCacheSize': encodingCacheSize, 'utf8': utf8, 'includeFields': includeFields, 'excludeFields': excludeFields}
+        # Journal names, publishers, authors etc. repeat a lot within a library, so remember the most recently encoded
+        # values. Use self.encode.cache_info() to inspect the hit/miss counts.
+        self.encode = lru_cache(maxsize=encodingCacheSize)(latex.latex_escape if utf8 else latex.latex_encode)
         # Maps Mendeley types to biblatex entry types
         self.entryTypeMap = {
             "ConferenceProceedings": "inproceedings",
@@ -113,10 +148,20 @@ class BibConverter(MendeleyEntryConverter):
             ]
         }
 
+    def getVersion(self):
+        version = MendeleyEntryConverter.getVersion(self)
+        return '%s/utf8' % version if self.options['utf8'] else version
+
+    def setProfiler(self, profiler):
+        MendeleyEntryConverter.setProfiler(self, profiler)
+        encode = self.encode
+        self.encode = profiler.wrap('latex encoding', encode)
+        self.encode.cache_info = encode.cache_info
+
     # This function is applied to all string or (string,string) key-value mappings as defined above.
     # NOTE: This function is _NOT_ applied by default to (string,function) mappings!
     def processGenericEntry(self, text):
-        return ('{%s}' % str(text).encode('latex').decode('ASCII')) if text else None
+        return ('{%s}' % self.encode(str(text))) if text else None
 
     def getConcatDocumentContributors(self, entry, type):
         contributors = self.db.getDocumentContributors(entry, type)
@@ -150,6 +195,7 @@ class BibConverter(MendeleyEntryConverter):
     def getUserType(self, entryType, entry):
         # only defined here to be able to warn the user if it is not present
         if not entry['userType']:
+            self.counters['entries.missingUserType'] += 1
             log.warning('Entry \'%s\' is of type \'%s\', but requires a field \'type\' not set automatically by Mendeley. Please use the \'Type\' field to specify the type of thesis, e.g. \'Master\'s Thesis\' or \'PhD Thesis\'!' % (entry['citationKey'],entryType))
         return self.processGenericEntry(entry['userType'])
 
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 *-*
+from __future__ import unicode_literals
+import hashlib
+import logging
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlsplit
+
+log = logging.getLogger(__name__)
+
+"""
+Serves the converted library over HTTP, so that several builds on the same machine can share a single exporter.
+The following paths are available:
+    /library.bib                 all entries
+    /folders/<folder>.bib        the entries in a folder, given by its path (e.g. /folders/Thesis/Chapter 1.bib) or id
+    /groups/<group>.bib          the entries in a group, given by its name or id
+Converted files are kept in memory until the database changes. Every response carries an ETag, so that clients sending
+If-None-Match get a 304 Not Modified in stead of the whole file when nothing changed.
+Requests are handled one at a time, on the thread that opened the database.
+"""
+class BibServer(HTTPServer):
+    def __init__(self, address, db, converter, onlyFavourites=False, recursive=False, jobs=1):
+        HTTPServer.__init__(self, address, BibRequestHandler)
+        self.db = db
+        self.converter = converter
+        self.onlyFavourites = onlyFavourites
+        self.recursive = recursive
+        self.jobs = jobs
+        self.files = {}
+        self.state = None
+
+    def getFile(self, path):
+        """Returns the (etag, content) of the .bib file at path, or None if there is no such file."""
+        state = self.db.getChangeState()
+        if state != self.state:
+            if self.files:
+                log.info('Database changed, dropping %d converted files' % len(self.files))
+            self.files = {}
+            self.state = state
+        if path not in self.files:
+            self.db.beginSnapshot()
+            try:
+                selection = self.getSelection(path)
+                if selection is None:
+                    return None
+                (folder, group) = selection
+                entries = self.db.getEntries(folder=folder, group=group, onlyFavourites=self.onlyFavourites, columns=self.converter.getColumns(), recursive=self.recursive, entryTypes=self.converter.entryTypeMap)
+                (numConverted, content) = self.converter.convertEntries(entries, self.jobs)
+            finally:
+                self.db.endSnapshot()
+            content = ('%s\n' % content).encode('utf-8')
+            log.info('Converted %d entries for %s' % (numConverted, path))
+            self.files[path] = ('"%s"' % hashlib.sha1(content).hexdigest(), content)
+        return self.files[path]
+
+    def getSelection(self, path):
+        """Maps a path to the (folder, group) ids to select entries from, or None if it does not match any."""
+        if not path.endswith('.bib'):
+            return None
+        path = path[:-len('.bib')]
+        if path == '/library':
+            return (None, None)
+        if path.startswith('/folders/'):
+            identifier = path[len('/folders'):]
+            folder = self.db.getFolderID(identifier[1:] if identifier[1:].isdigit() else identifier)
+            return (folder, None) if folder is not None else None
+        if path.startswith('/groups/'):
+            group = self.db.getGroupID(path[len('/groups/'):])
+            return (None, group) if group is not None else None
+        return None
+
+class BibRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.respond(True)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def respond(self, sendContent):
+        path = unquote(urlsplit(self.path).path)
+        if path == '/':
+            path = '/library.bib'
+        try:
+            bib = self.server.getFile(path)
+        except Exception:
+            log.exception('Failed to export %s' % path)
+            self.send_error(500)
+            return
+        if bib is None:
+            self.send_error(404)
+            return
+        (etag, content) = bib
+        matches = [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]
+        if etag in matches or '*' in matches:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-bibtex; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if sendContent:
+            self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        log.debug('%s: %s' % (self.address_string(), format % args))
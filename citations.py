@@ -0,0 +1,46 @@
+# -*- coding: utf-8 *-*
+from __future__ import unicode_literals
+import io
+import os
+import re
+import logging
+
+log = logging.getLogger(__name__)
+
+"""
+Collects the keys cited by a LaTeX document, from the .aux files written by latex (for bibtex, or biblatex with
+backend=bibtex) or the .bcf file written by biblatex for biber.
+"""
+
+_auxCitation = re.compile(r'\\citation\{([^}]*)\}|\\abx@aux@cite(?:\{[^}]*\})?\{([^}]*)\}')
+_auxInput = re.compile(r'\\@input\{([^}]*)\}')
+_bcfCitation = re.compile(r'<bcf:citekey\b[^>]*>([^<]*)</bcf:citekey>')
+
+def readCitedKeys(filenames):
+    """
+    Returns the set of keys cited in the given .aux and .bcf files, following the \\@input of included .aux files, or
+    None when the document cites all entries using \\nocite{*}.
+    """
+    keys = set()
+    pending = list(filenames)
+    seen = set()
+    while pending:
+        filename = pending.pop()
+        if os.path.abspath(filename) in seen:
+            continue
+        seen.add(os.path.abspath(filename))
+        with io.open(filename, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+        if filename.endswith('.bcf'):
+            found = _bcfCitation.findall(content)
+        else:
+            found = [key for match in _auxCitation.findall(content) for keys in match for key in keys.split(',')]
+            pending.extend([os.path.join(os.path.dirname(filename), included) for included in _auxInput.findall(content)])
+        for key in found:
+            key = key.strip()
+            if key == '*':
+                return None
+            if key:
+                keys.add(key)
+    log.debug('Found %d cited keys in %s' % (len(keys), ', '.join(filenames)))
+    return keys
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 *-*
+from __future__ import unicode_literals
+import os
+import sys
+import time
+import logging
+from argparse import ArgumentParser
+from exporter import Mendeley2Bib, exportDatabase, writeReport, writeFolderOutputs, writeIfChanged, AtomicOutput, getFileState, watchDatabase
+
+log = logging.getLogger(__name__)
+
+def checkDatabase(db):
+    """Exits with an error when db lacks the Mendeley tables, e.g. when it was created by accident."""
+    if not db.getDocumentColumns():
+        log.error('Database \'%s\' has no Documents table; is it a Mendeley Desktop database?' % db.db)
+        sys.exit(-1)
+
+"""
+The command line interface of mendeley2bib.py. It lives in a module of its own, so that it is compiled once and loaded
+from the bytecode cache, like the exporter itself, in stead of being compiled again on every run of the script.
+"""
+def main():
+    m2b = Mendeley2Bib()
+
+    argparser = ArgumentParser(description='Convert Mendeley entries to a Biblatex-compatible bib file')
+    argparser.add_argument('-d', '--dbfile', dest='dbfiles', metavar='NAME', action='append', help='The database to load. Use -l to list all available databases. Required when more than one database is available. May be given more than once to export several databases concurrently, one output file each (see -o)', default=None)
+    argparser.add_argument('--all-databases', dest='allDatabases', action='store_const', const=True, default=False, help='Export all available databases concurrently, one output file each (see -o)')
+    argparser.add_argument('-f', '--folder', metavar='FOLDER', help='The folder to process entries from. By default all folders are traversed. Use -lf to see available folders. May be either given as ID or name; when the argument is numeric, it is assumed to be the ID.', default=None)
+    argparser.add_argument('-r', '--recursive', dest='recursive', action='store_const', const=True, default=False, help='Include the entries in subfolders of the folder given by -f, or of each folder with -F')
+    argparser.add_argument('-g', '--group', metavar='GROUP', help='The group to process entries from. By default all groups are traversed. Use -lg to see available groups. May be either given as ID or name; when the argument is numeric, it is assumed to be the ID.', default=None)
+    argparser.add_argument('--cited', metavar='FILE', nargs='+', default=None, help='Only export the entries cited by a LaTeX document, as listed in its .aux files (bibtex) or .bcf file (biber). In watch mode, the files are watched for changes as well, and read again on every export')
+    argparser.add_argument('-o', '--output', metavar='FILE', help='Write the .bib file to FILE in stead of stdout. FILE is replaced atomically, and left untouched when its contents did not change. When exporting several databases, {db} in FILE is replaced by the name of each database (default: {db}.bib)', default=None)
+    argparser.add_argument('-F', '--per-folder', dest='perFolder', metavar='DIRECTORY', default=None, help='In stead of a single .bib file, write one .bib file per Mendeley folder into DIRECTORY, mirroring the folder tree. The library is read and converted only once')
+    argparser.add_argument('-s', '--starred', dest='onlyFavourites', action='store_const', const=True, default=False, help='Only process starred (favourite) items')
+    
+    argparser.add_argument('-l', '--list', dest='list', action='store_const', const=True, default=False, help='In stead of processing a database, list available databases.')
+    argparser.add_argument('-lf', '--list-folders', dest='listfolders', action='store_const', const=True, default=False, help='Just list all available Mendeley folders')
+    argparser.add_argument('-lg', '--list-groups', dest='listgroups', action='store_const', const=True, default=False, help='Just list all available Mendeley groups')
+    
+    argparser.add_argument('-p', '--prefetch', dest='prefetch', action='store_const', const=True, default=False, help='Load the authors, tags, keywords and URLs of all selected entries up front using a single query per table, in stead of querying them for every entry. Much faster for large libraries, at the cost of some memory')
+    argparser.add_argument('-c', '--cache', metavar='FILE', help='Keep converted entries in cache file FILE, so that subsequent runs only convert new or modified entries. Combine with -p for best results', default=None)
+    argparser.add_argument('-w', '--watch', dest='watch', action='store_const', const=True, default=False, help='Keep running, and re-export whenever the Mendeley database changes. The output file given by -o is only replaced when its contents change')
+    argparser.add_argument('--interval', metavar='SECONDS', type=float, default=2.0, help='How often to check the database for changes in watch mode (default: 2 seconds)')
+    fieldList = lambda value: [field.strip() for field in value.split(',') if field.strip()]
+    argparser.add_argument('--include-fields', dest='includeFields', metavar='FIELDS', type=fieldList, default=None, help='Only write the comma-separated fields FIELDS (e.g. author,title,year,journal), and skip reading the data needed for any others')
+    argparser.add_argument('--exclude-fields', dest='excludeFields', metavar='FIELDS', type=fieldList, default=None, help='Do not write the comma-separated fields FIELDS (e.g. abstract,mendeley-tags), and skip reading the data needed for them')
+    argparser.add_argument('--utf8', dest='utf8', action='store_const', const=True, default=False, help='Keep non-ASCII characters as they are in stead of writing them as LaTeX commands, and only escape %%, # and &. Like without this option, LaTeX markup in fields such as {DNA} or $\\alpha$ is kept as it is. The .bib file is written as UTF-8, which biber reads natively; for bibtex, leave this off')
+    argparser.add_argument('--encoding-cache', dest='encodingCacheSize', metavar='SIZE', type=int, default=4096, help='The number of most recently latex-encoded field values to remember, to avoid encoding recurring values such as journal names over and over (default: 4096; 0 disables the cache)')
+    argparser.add_argument('--serve', metavar='PORT', type=int, default=None, help='Keep running, and serve the converted library over HTTP on PORT: /library.bib, /folders/<folder>.bib and /groups/<group>.bib. Converted files are kept in memory until the database changes')
+    argparser.add_argument('--bind', metavar='ADDRESS', default='127.0.0.1', help='The address to serve on (default: %(default)s)')
+    argparser.add_argument('-j', '--jobs', metavar='N', type=int, default=1, help='Convert entries using N worker processes. The output is identical to that of a single process. Combine with -p for best results')
+    argparser.add_argument('--profile', metavar='FILE', nargs='?', const=True, default=None, help='Print a summary of the number of calls and the time spent per SQL statement, field, latex encoding and output writing. When FILE is given, also dump cProfile statistics to it, to be read with pstats. Fields converted by worker processes (-j) are not included')
+    argparser.add_argument('--report', metavar='FILE', default=None, help='After a successful export, write a report for monitoring to FILE: the number of entries read, converted and skipped per reason, generated and written citation keys, the time per stage, the number of SQL statements, the output size and cache hit rates. Written as JSON, or in the Prometheus text format when FILE ends in .prom')
+    argparser.add_argument('--snapshot', choices=['readonly', 'memory'], default=None, help='Read a consistent snapshot of the database, so that Mendeley Desktop can keep running: either open it read-only and run the whole export in a single read transaction, or copy it into memory first')
+    argparser.add_argument('-k', '--write-keys', dest='writebackKeys', action='store_const', const=True, default=False, help='When an absent citation key is generated, write it back to the Mendeley database. Without this, generated keys that collide get a suffix (a, b, ...) that depends on which entries are exported, so the same document may get different keys from e.g. -f and a full export. NOTE: this only works when Mendeley Desktop is not running, since it locks its database')
+    argparser.add_argument('-v', '--verbose', dest='loglevel', action='store_const', const=logging.DEBUG, default=logging.INFO, help='Set debug level to DEBUG in stead of INFO')
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=args.loglevel, format='\n%(levelname)s: %(message)s')
+
+    if args.list:
+        print('Available databases:')
+        choices = 0
+        for db in m2b.getDatabases():
+            print('- %s' % db)
+            choices += 1
+        if choices == 0:
+            print('None! Please connect to a Mendeley account first using Mendeley Desktop')
+        sys.exit(0)
+
+    # the modes exclude each other, and some options only apply to some of them
+    if args.perFolder and (args.watch or args.serve is not None):
+        log.error('Exporting one file per folder can not be combined with -w or --serve.')
+        sys.exit(-1)
+    if args.perFolder and (args.folder or args.output):
+        log.error('Exporting one file per folder can not be combined with -f or -o.')
+        sys.exit(-1)
+    if args.watch and args.serve is not None:
+        log.error('Watch mode can not be combined with --serve.')
+        sys.exit(-1)
+    if args.watch and not args.output:
+        log.error('Watch mode requires an output file to be given using -o.')
+        sys.exit(-1)
+    if args.serve is not None and (args.folder or args.group or args.output or args.writebackKeys or args.cited):
+        log.error('Serve mode can not be combined with -f, -g, -o, -k or --cited; request the folder or group in the URL.')
+        sys.exit(-1)
+    if args.report and (args.watch or args.serve is not None):
+        log.error('A run report can not be written in watch or serve mode.')
+        sys.exit(-1)
+    if args.snapshot and args.writebackKeys:
+        log.error('Citation keys can not be written back to a read-only snapshot of the database; use either --snapshot or -k.')
+        sys.exit(-1)
+
+    for filename in args.cited or []:
+        if not os.path.isfile(filename):
+            log.error('Cited keys file \'%s\' not found!' % filename)
+            sys.exit(-1)
+
+    databases = m2b.getDatabases() if args.allDatabases else (args.dbfiles or [])
+    if args.allDatabases and not databases:
+        print('None! Please connect to a Mendeley account first using Mendeley Desktop')
+        sys.exit(-1)
+    if len(databases) > 1 or args.allDatabases:
+        if args.listfolders or args.listgroups or args.perFolder or args.watch or args.serve is not None or args.cache or args.jobs > 1 or args.profile or args.report:
+            log.error('Exporting several databases can not be combined with -lf, -lg, -F, -w, --serve, -c, -j, --profile or --report.')
+            sys.exit(-1)
+        output = args.output or '{db}.bib'
+        if '{db}' not in output:
+            log.error('When exporting several databases, the output file given by -o must contain {db}.')
+            sys.exit(-1)
+        from citations import readCitedKeys
+        options = {
+            'folder': args.folder, 'group': args.group, 'recursive': args.recursive, 'onlyFavourites': args.onlyFavourites,
+            'prefetch': args.prefetch, 'snapshot': args.snapshot, 'writebackKeys': args.writebackKeys,
+            'citationKeys': readCitedKeys(args.cited) if args.cited else None,
+            'encodingCacheSize': args.encodingCacheSize, 'utf8': args.utf8, 'output': output,
+            'includeFields': args.includeFields, 'excludeFields': args.excludeFields,
+        }
+        import multiprocessing
+        start = time.time()
+        pool = multiprocessing.Pool(min(len(databases), multiprocessing.cpu_count()))
+        try:
+            results = pool.map(exportDatabase, [(name, m2b.mendeleyFolder, options) for name in databases], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        failed = 0
+        summary = ['Exported %d databases in %.2fs:' % (len(databases), time.time() - start)]
+        for (name, numConverted, written, elapsed, error) in results:
+            if error is not None:
+                failed += 1
+                result = 'FAILED: %s' % error
+            else:
+                result = '%s %s' % ('wrote' if written else 'unchanged', output.replace('{db}', name))
+            summary.append('  %-40s %7d entries %8.2fs  %s' % (name, numConverted, elapsed, result))
+        summary.append('  %-40s %7d entries' % ('total', sum([result[1] for result in results])))
+        log.info('\n'.join(summary))
+        sys.exit(-1 if failed else 0)
+
+    args.dbfile = databases[0] if databases else None
+    # only look for databases when none was given, which saves listing the Mendeley folder on every run
+    if not args.dbfile and len(m2b.getDatabases()) == 1:
+        args.dbfile = m2b.getDatabases()[0]
+
+    if not args.dbfile:
+        print('Please specify the database file to use. Choices are:')
+        choices = 0
+        for db in m2b.getDatabases():
+            print('- %s' % db)
+            choices += 1
+        if choices == 0:
+            print('None! Please connect to a Mendeley account first using Mendeley Desktop')
+        sys.exit(-1)
+
+    if not os.path.isfile(m2b.getDatabaseFile(args.dbfile)):
+        log.error('Database \'%s\' not found! Use -l to list available databases.' % args.dbfile)
+        sys.exit(-1)
+
+    if args.listfolders:
+        with m2b.openDatabase(args.dbfile) as db:
+            checkDatabase(db)
+            print('Available Mendeley folders:')
+            for (id, folder) in sorted(db.getFolders().items(), key=lambda x: x[1]):
+                print('%d: %s' % (id, folder))
+            sys.exit(0)
+            
+    if args.listgroups:
+        with m2b.openDatabase(args.dbfile) as db:
+            checkDatabase(db)
+            print('Available Mendeley groups:')
+            for (id, group) in sorted(db.getGroups().items(), key=lambda x: x[1]):
+                print('%d: %s' % (id, group))
+            sys.exit(0)
+
+    numConverted = 0
+    profiler = None
+    if args.profile:
+        from profiler import Profiler
+        profiler = Profiler()
+        if args.profile is not True:
+            import cProfile
+            cprofile = cProfile.Profile()
+            cprofile.enable()
+
+    report = None
+    if args.report:
+        from runreport import RunReport
+        report = RunReport()
+        report.set('database', args.dbfile)
+        report.stage('open')
+
+    try:
+        with m2b.openDatabase(args.dbfile, prefetch=args.prefetch, snapshot=args.snapshot) as db:
+            checkDatabase(db)
+            from bibconverter import BibConverter
+            from citations import readCitedKeys
+            sqlProfiler = profiler
+            if profiler is not None:
+                db.conn = profiler.wrapConnection(db.conn)
+            elif report is not None:
+                # only used to count the SQL statements
+                from profiler import Profiler
+                sqlProfiler = Profiler()
+                db.conn = sqlProfiler.wrapConnection(db.conn)
+            folderID = None
+            if args.folder:
+                folderID = db.getFolderID(args.folder)
+                if folderID is None:
+                    log.error('Folder \'%s\' not found! Use -lf to list available folders.' % args.folder)
+                    sys.exit(-1)
+            groupID = None
+            if args.group:
+                groupID = db.getGroupID(args.group)
+                if groupID is None:
+                    log.error('Group \'%s\' not found! Use -lg to list available groups.' % args.group)
+                    sys.exit(-1)
+            converter = BibConverter(db, encodingCacheSize=args.encodingCacheSize, utf8=args.utf8, includeFields=args.includeFields, excludeFields=args.excludeFields)
+            unknownFields = set((args.includeFields or []) + (args.excludeFields or [])) - converter.getFieldNames()
+            if unknownFields:
+                log.warning('Unknown fields %s; available fields are %s' % (', '.join(sorted(unknownFields)), ', '.join(sorted(converter.getFieldNames()))))
+            # only read the related tables the selected fields need
+            db.relatedTables = converter.getRelatedTables() or db.relatedTables
+            if profiler is not None:
+                converter.setProfiler(profiler)
+            if args.cache:
+                from entrycache import EntryCache
+                converter.cache = EntryCache(args.cache, converter.getVersion())
+            getEntries = lambda: db.getEntries(folder=folderID, group=groupID, onlyFavourites=args.onlyFavourites, writebackKeys=args.writebackKeys, columns=converter.getColumns(), recursive=args.recursive, citationKeys=readCitedKeys(args.cited) if args.cited else None, entryTypes=converter.entryTypeMap)
+
+            if args.perFolder:
+                try:
+                    if report is not None:
+                        report.stage('export')
+                    (numConverted, numWritten) = writeFolderOutputs(db, converter, getEntries(), args.perFolder, args.jobs, args.recursive)
+                    if report is not None:
+                        report.stage('finish')
+                    if converter.cache is not None:
+                        converter.cache.evict(db.getDocumentIds())
+                finally:
+                    if converter.cache is not None:
+                        converter.cache.close()
+                if report is not None:
+                    report.set('entries.converted', numConverted)
+                    report.set('output.files', numWritten)
+                    writeReport(report, args.report, db, converter, sqlProfiler)
+                log.info('Successfully converted %d Mendeley Desktop entries from database %s, and wrote %d folder files to %s' % (numConverted, args.dbfile, numWritten, args.perFolder))
+                sys.exit(0)
+
+            if args.watch:
+                def export():
+                    db.beginSnapshot()
+                    try:
+                        try:
+                            entries = getEntries()
+                        except (IOError, OSError) as e:
+                            # e.g. while latex is rewriting the .aux files; they are watched, so we export again once they are back
+                            log.warning('Could not read the cited keys, %s left untouched: %s' % (args.output, e))
+                            return
+                        (numConverted, content) = converter.convertEntries(entries, args.jobs)
+                    finally:
+                        db.endSnapshot()
+                    if converter.cache is not None:
+                        converter.cache.evict(db.getDocumentIds())
+                    if writeIfChanged(args.output, '%s\n' % content):
+                        log.info('Wrote %d Mendeley Desktop entries to %s' % (numConverted, args.output))
+                    else:
+                        log.info('Exported entries did not change, %s left untouched' % args.output)
+                try:
+                    log.info('Watching database %s for changes; press ctrl+c to stop' % args.dbfile)
+                    watchDatabase(db, export, interval=args.interval, extraState=(lambda: getFileState(args.cited)) if args.cited else None)
+                finally:
+                    if converter.cache is not None:
+                        converter.cache.close()
+                sys.exit(0)
+
+            if args.serve is not None:
+                from bibserver import BibServer
+                server = BibServer((args.bind, args.serve), db, converter, onlyFavourites=args.onlyFavourites, recursive=args.recursive, jobs=args.jobs)
+                try:
+                    log.info('Serving database %s on http://%s:%d/library.bib; press ctrl+c to stop' % (args.dbfile, args.bind, server.server_address[1]))
+                    server.serve_forever()
+                except KeyboardInterrupt:
+                    pass
+                finally:
+                    server.server_close()
+                    if converter.cache is not None:
+                        converter.cache.close()
+                sys.exit(0)
+
+            if args.utf8 and not args.output and sys.stdout.encoding.lower().replace('-', '') != 'utf8':
+                sys.stdout.reconfigure(encoding='utf-8')
+            output = AtomicOutput(args.output) if args.output else sys.stdout
+            stream = report.wrapStream(output) if report else output
+            stream = profiler.wrapStream(stream) if profiler else stream
+            try:
+                if report is not None:
+                    report.stage('export')
+                numConverted = converter.writeEntries(getEntries(), stream, args.jobs)
+                stream.write('\n')
+                if report is not None:
+                    report.stage('finish')
+                if converter.cache is not None:
+                    converter.cache.evict(db.getDocumentIds())
+                log.debug('Encoding cache: %d hits, %d misses' % converter.encode.cache_info()[:2])
+            except:
+                if args.output:
+                    output.discard()
+                raise
+            else:
+                if args.output:
+                    written = output.close()
+                    if written:
+                        log.info('Wrote %d Mendeley Desktop entries to %s' % (numConverted, args.output))
+                    else:
+                        log.info('Exported entries did not change, %s left untouched' % args.output)
+                    if report is not None:
+                        report.set('output.written', written)
+            finally:
+                if converter.cache is not None:
+                    converter.cache.close()
+            if report is not None:
+                report.set('entries.converted', numConverted)
+                writeReport(report, args.report, db, converter, sqlProfiler)
+
+        log.info('Successfully converted %d Mendeley Desktop entries from database %s' % (numConverted, args.dbfile))
+    finally:
+        # -F, watch and serve mode exit from within the block above, and the summary should cover failed exports too
+        if profiler is not None:
+            if args.profile is not True:
+                cprofile.disable()
+                cprofile.dump_stats(args.profile)
+                log.info('Wrote cProfile statistics to %s' % args.profile)
+            profiler.report()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 *-*
+from __future__ import unicode_literals
+import sqlite3
+import logging
+
+log = logging.getLogger(__name__)
+
+"""
+Persistent on-disk cache of converted entries, stored in a sqlite file.
+Entries are keyed by their Mendeley document id, and are only considered valid when both the fingerprint of the
+document (see Mendeley2Bib.openDatabase.getFingerprint) and the version of the converter that produced them match.
+The entries of the current version are all loaded up front using a single query, in stead of one query per entry.
+"""
+class EntryCache:
+    def __init__(self, filename, version):
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS Entries (documentId INTEGER PRIMARY KEY, fingerprint TEXT, version TEXT, output TEXT);')
+        # documentId -> (fingerprint, output)
+        self.entries = dict([(row[0], (row[1], row[2])) for row in self.conn.execute('SELECT documentId, fingerprint, output FROM Entries WHERE version=?;', [version])])
+
+    def get(self, documentId, fingerprint):
+        """Returns the cached output for a document, or None when it is absent, changed or produced by another converter version."""
+        cached = self.entries.get(documentId)
+        if cached is None or cached[0] != fingerprint:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cached[1]
+
+    def put(self, documentId, fingerprint, output):
+        self.entries[documentId] = (fingerprint, output)
+        self.conn.execute('INSERT OR REPLACE INTO Entries VALUES (?, ?, ?, ?);', [documentId, fingerprint, self.version, output])
+
+    def evict(self, documentIds):
+        """
+        Removes the entries of all documents not in documentIds, the ids of the documents that still exist.
+        Documents that a filtered run (e.g. one folder) did not read are kept, so that runs can share a cache.
+        """
+        self.conn.execute('CREATE TEMPORARY TABLE IF NOT EXISTS Existing (documentId INTEGER PRIMARY KEY);')
+        self.conn.execute('DELETE FROM temp.Existing;')
+        self.conn.executemany('INSERT OR IGNORE INTO temp.Existing VALUES (?);', [(documentId,) for documentId in documentIds])
+        count = self.conn.execute('DELETE FROM Entries WHERE documentId NOT IN (SELECT documentId FROM temp.Existing);').rowcount
+        if count:
+            log.debug('Evicted %d entries from the cache' % count)
+            existing = set(documentIds)
+            self.entries = dict([(documentId, cached) for (documentId, cached) in self.entries.items() if documentId in existing])
+        self.conn.execute('DELETE FROM temp.Existing;')
+        self.conn.commit()
+
+    def close(self):
+        log.debug('Entry cache: %d hits, %d misses' % (self.hits, self.misses))
+        self.conn.commit()
+        self.conn.close()
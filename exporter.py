@@ -0,0 +1,979 @@
+# -*- coding: utf-8 *-*
+from __future__ import unicode_literals
+import io
+import os
+import re
+import sys
+import time
+import sqlite3
+import unicodedata
+import logging
+from string import Template
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+class Row(object):
+    """
+    Compact representation of a database row: the values are kept in a list, and the mapping of column names to
+    positions is shared between all rows of a query. Supports the dict operations the converters use.
+    """
+    __slots__ = ('index', 'values')
+
+    def __init__(self, index, values):
+        self.index = index
+        self.values = values
+
+    def __getitem__(self, column):
+        return self.values[self.index[column]]
+
+    def __setitem__(self, column, value):
+        self.values[self.index[column]] = value
+
+    def __contains__(self, column):
+        return column in self.index
+
+    def get(self, column, default=None):
+        return self.values[self.index[column]] if column in self.index else default
+
+    def keys(self):
+        return self.index.keys()
+
+    def items(self):
+        return [(column, self.values[idx]) for (column, idx) in self.index.items()]
+
+    def __getstate__(self):
+        return (self.index, self.values)
+
+    def __setstate__(self, state):
+        (self.index, self.values) = state
+
+class Mendeley2Bib:
+    databases = None
+    mendeleyFolder = None
+
+    def __init__(self):
+        self.mendeleyFolder = self.getMendeleyFolder()
+        self.openDatabase.mendeleyFolder = self.mendeleyFolder
+
+    def getMendeleyFolder(self):
+        import platform
+        if platform.system() == 'Windows':
+            from win32com.shell import shellcon, shell
+            hdir = shell.SHGetFolderPath(0, shellcon.CSIDL_LOCAL_APPDATA, 0, 0)
+            hdir = os.path.join(hdir, 'Mendeley Ltd', 'Mendeley Desktop')
+        elif platform.system() == 'Darwin':
+            hdir = os.path.expanduser("~/Library/Application Support/Mendeley Desktop")
+        else:
+            hdir = os.path.expanduser("~/.local/share/data/Mendeley Ltd./Mendeley Desktop")
+        return hdir
+
+    def getDatabaseFile(self, name):
+        return os.path.join(self.mendeleyFolder, '%s@www.mendeley.com.sqlite' % name)
+
+    def getDatabases(self):
+        if not self.databases:
+            files = os.listdir(self.mendeleyFolder)
+            self.databases = [f[:-24] for f in files if f.endswith('@www.mendeley.com.sqlite')]
+        return self.databases
+
+    class openDatabase:
+        # Tables holding per-document rows that can be loaded up front in prefetch mode
+        relatedTables = ['DocumentContributors', 'DocumentTags', 'DocumentKeywords', 'DocumentUrls']
+
+        # Pragmas applied in snapshot mode, tuned for reading the whole database sequentially
+        snapshotPragmas = ['PRAGMA mmap_size=268435456;', 'PRAGMA cache_size=-65536;']
+
+        def __init__(self, db, prefetch=False, snapshot=None):
+            """
+            snapshot may be None, to open the database read-write, 'readonly', to open it read-only and run all queries
+            in a single read transaction, or 'memory', to copy it to an in-memory database and read that copy.
+            """
+            self.db = db
+            self.prefetch = prefetch
+            self.snapshot = snapshot
+            self.inSnapshot = False
+            self.related = None
+            # number of entries read, skipped and given a key, see getEntries
+            self.counters = Counter(dict.fromkeys(['entries.read', 'entries.skipped.missingKey', 'entries.skipped.notCited', 'keys.generated', 'keys.written'], 0))
+
+        def __enter__(self):
+            self.filename = os.path.join(self.mendeleyFolder, '%s@www.mendeley.com.sqlite' % self.db)
+            # sqlite would silently create an empty database in stead
+            if not os.path.isfile(self.filename):
+                raise IOError('Mendeley database \'%s\' not found: %s does not exist' % (self.db, self.filename))
+            if self.snapshot == 'readonly':
+                self.conn = self.connectReadOnly()
+            elif self.snapshot == 'memory':
+                self.conn = sqlite3.connect(':memory:')
+            else:
+                self.conn = sqlite3.connect(self.filename)
+            # all rows of a query share a single column index, which is only rebuilt when the query changes
+            index = [None, None]
+            def row_factory(cursor, row):
+                if cursor.description is not index[0]:
+                    index[0] = cursor.description
+                    index[1] = dict([(col[0], idx) for (idx, col) in enumerate(cursor.description)])
+                return Row(index[1], list(row))
+            self.conn.row_factory=row_factory
+            self.documentColumns = None
+            self.folderTree = None
+            if self.snapshot:
+                self.beginSnapshot()
+            return self
+
+        def __exit__(self, type, value, traceback):
+            self.endSnapshot()
+            self.conn.close()
+
+        def connectReadOnly(self):
+            from urllib.request import pathname2url
+            conn = sqlite3.connect('file:%s?mode=ro' % pathname2url(os.path.abspath(self.filename)), uri=True)
+            for pragma in self.snapshotPragmas:
+                conn.execute(pragma)
+            return conn
+
+        def beginSnapshot(self):
+            """
+            Makes all following queries see the database as it is now, until endSnapshot is called: in readonly mode
+            by starting a read transaction, in memory mode by copying the database using the sqlite backup API.
+            """
+            if self.inSnapshot:
+                return
+            # folders may have changed since the previous snapshot
+            self.folderTree = None
+            if self.snapshot == 'readonly':
+                self.conn.execute('BEGIN;')
+                # a deferred transaction only takes its snapshot on the first read
+                self.conn.execute('SELECT COUNT(*) FROM sqlite_master;').fetchone()
+            elif self.snapshot == 'memory':
+                source = self.connectReadOnly()
+                try:
+                    source.backup(self.conn)
+                finally:
+                    source.close()
+                self.documentColumns = None
+            self.inSnapshot = True
+
+        def endSnapshot(self):
+            """Ends the read transaction of beginSnapshot, so that Mendeley Desktop is free to write again."""
+            if self.inSnapshot and self.snapshot == 'readonly':
+                self.conn.rollback()
+            self.inSnapshot = False
+
+        def getEntries(self, folder=None, group=None, onlyFavourites=False, writebackKeys=False, columns=None, recursive=False, citationKeys=None, entryTypes=None):
+            """
+            Yields the selected Documents rows. When columns is given, only those columns are read (as far as they exist
+            in this version of the Mendeley database); otherwise all of them are. When recursive is set, documents in
+            subfolders of folder are included as well. When citationKeys is given, only the documents with one of those
+            keys are read, plus those without a key, which are dropped unless the key generated for them is one of them.
+            When entryTypes is given, no key is generated (nor reserved) for documents of other types, which the
+            converter will skip anyway.
+            """
+            if not self.getDocumentColumns():
+                raise sqlite3.DatabaseError('%s has no Documents table; is it a Mendeley Desktop database?' % self.filename)
+            if columns is None:
+                select = 'd.*'
+            else:
+                select = ', '.join(['d."%s"' % column for column in columns if column in self.getDocumentColumns()])
+            condition = 'd.deletionPending != \'true\''
+            params = []
+            if folder is not None:
+                if folder == 0:
+                    condition = '%s AND d.id NOT IN (SELECT documentID FROM DocumentFolders)' % condition
+                elif recursive:
+                    condition = '%s AND d.id IN (SELECT documentID FROM DocumentFolders AS df WHERE df.folderId IN (WITH RECURSIVE Subfolders(id) AS (SELECT ? UNION SELECT f.id FROM Folders AS f JOIN Subfolders AS s ON f.parentId = s.id) SELECT id FROM Subfolders))' % condition
+                    params.append(folder)
+                else:
+                    condition = '%s AND d.id IN (SELECT documentID FROM DocumentFolders AS df WHERE df.folderId = ?)' % condition
+                    params.append(folder)
+            if group is not None:
+                condition = '%s AND d.id IN (SELECT documentID FROM RemoteDocuments AS rd WHERE rd.groupId = ?)' % condition
+                params.append(group)
+            if onlyFavourites:
+                condition = '%s AND d.favourite = \'true\'' % condition
+            if citationKeys is not None:
+                # a temporary table keeps the query plan a join on citationKey, however many keys there are
+                self.conn.execute('CREATE TEMPORARY TABLE IF NOT EXISTS CitedKeys (citationKey TEXT PRIMARY KEY);')
+                self.conn.execute('DELETE FROM temp.CitedKeys;')
+                self.conn.executemany('INSERT INTO temp.CitedKeys VALUES (?);', [(key,) for key in citationKeys])
+                if not (self.inSnapshot and self.snapshot == 'readonly'):
+                    # filling the table opened an implicit transaction, which would keep Mendeley Desktop locked out;
+                    # only the read transaction of a readonly snapshot is meant to last, and ends in endSnapshot
+                    self.conn.commit()
+                condition = '%s AND (d.citationKey IN (SELECT citationKey FROM temp.CitedKeys) OR d.citationKey IS NULL OR d.citationKey = \'\')' % condition
+            if self.prefetch:
+                self.prefetchRelated(condition, params)
+            # rows are yielded straight off the cursor, so the whole Documents table is never held in memory
+            self.citationKeys = None
+            writeback = []
+            try:
+                for entry in self.conn.execute('SELECT %s FROM Documents AS d WHERE %s;' % (select, condition), params):
+                    self.counters['entries.read'] += 1
+                    entrytype = entry['type']
+                    # documents of types the converter skips are passed on as they are, without taking up a key
+                    if not entry['citationKey'] and (entryTypes is None or entrytype in entryTypes):
+                        authors = self.getDocumentContributors(entry, 'DocumentAuthor')
+                        if authors and entry['year']:
+                            entry['citationKey'] = self.generateCitationKey('%s%s' % (authors[0]['lastName'], entry['year']))
+                            if citationKeys is not None and entry['citationKey'] not in citationKeys:
+                                self.counters['entries.skipped.notCited'] += 1
+                                continue
+                            self.counters['keys.generated'] += 1
+                            if writebackKeys:
+                                writeback.append((entry['citationKey'], entry['id']))
+                                log.info('%s entry \'%s\' lacks a citation key, generated as \'%s\' and written to Mendeley db' % (entrytype, entry['title'], entry['citationKey']))
+                            else:
+                                log.warning('%s entry \'%s\' lacks a citation key, but it has been generated to be \'%s\'. Be careful, as changing the author/year changes this generated key. Set one in Mendeley Desktop (quickest way: ctrl+a ctrl+k), or use the -k argument.' % (entrytype, entry['title'], entry['citationKey']))
+                        elif citationKeys is not None:
+                            self.counters['entries.skipped.notCited'] += 1
+                            continue
+                        else:
+                            log.warning('%s entry \'%s\' lacks a citation key, and none could be generated because it lacks authors and/or a year! It will be excluded from the .bib file as there is no way to reference it.' % (entrytype, entry['title']))
+                            self.counters['entries.skipped.missingKey'] += 1
+                            continue
+                    yield entry
+            finally:
+                if writeback:
+                    # a single transaction, to hold Mendeley's lock as briefly as possible
+                    with self.conn:
+                        self.conn.executemany('UPDATE Documents SET citationKey=? WHERE id=?;', writeback)
+                    self.counters['keys.written'] += len(writeback)
+                    log.info('Wrote %d generated citation keys to Mendeley db' % len(writeback))
+
+        def getDocumentIds(self):
+            """Returns the ids of all documents that are not deleted."""
+            return [row['id'] for row in self.conn.execute('SELECT id FROM Documents WHERE deletionPending != \'true\';')]
+
+        def getDocumentColumns(self):
+            if self.documentColumns is None:
+                self.documentColumns = set([row['name'] for row in self.conn.execute('PRAGMA table_info(Documents);')])
+            return self.documentColumns
+
+        def generateCitationKey(self, key):
+            """
+            Returns key, or when another document already uses it, the first of keya, keyb, ..., keyz, keyaa, ...
+            that is still free. The keys in use are loaded once per getEntries call.
+            Suffixes are handed out in the order in which documents are read, so unless the generated keys are written
+            back (-k), the key of a document may differ between exports with different filters (-f, -g, -s, --cited).
+            """
+            if self.citationKeys is None:
+                self.citationKeys = set([row['citationKey'] for row in self.conn.execute('SELECT citationKey FROM Documents WHERE citationKey IS NOT NULL AND citationKey != \'\';')])
+                self.citationKeySuffixes = {}
+            candidate = key
+            while candidate in self.citationKeys:
+                # continue where the previous collision on this key left off
+                index = self.citationKeySuffixes.get(key, 0)
+                self.citationKeySuffixes[key] = index + 1
+                suffix = ''
+                while True:
+                    suffix = chr(ord('a') + index % 26) + suffix
+                    index = index // 26 - 1
+                    if index < 0:
+                        break
+                candidate = '%s%s' % (key, suffix)
+            self.citationKeys.add(candidate)
+            return candidate
+
+        def getFolderMemberships(self):
+            """Returns a dict mapping document ids to the ids of the folders the document is in."""
+            memberships = {}
+            for row in self.conn.execute('SELECT documentId, folderId FROM DocumentFolders;'):
+                memberships.setdefault(row['documentId'], []).append(row['folderId'])
+            return memberships
+
+        def getChangeState(self):
+            """
+            Returns a cheap-to-compute value that changes whenever another connection (i.e. Mendeley Desktop) modifies
+            the database: sqlite's data_version combined with the size and mtime of the database file and its journal.
+            """
+            state = [self.conn.execute('PRAGMA data_version;').fetchone()['data_version']]
+            for filename in [self.filename, '%s-wal' % self.filename]:
+                try:
+                    stat = os.stat(filename)
+                    state.extend([stat.st_size, stat.st_mtime])
+                except OSError:
+                    state.extend([None, None])
+            return tuple(state)
+
+        def getFolderTree(self):
+            """
+            Builds the index of the folder tree once per connection: a dict of folder ids to their full path names,
+            its inverse, and a dict of folder ids to the ids of their subfolders. The path names are constructed by
+            sqlite in a single recursive query.
+            """
+            if self.folderTree is None:
+                names = {0: '/'}
+                children = {}
+                query = """WITH RECURSIVE Tree(id, parentId, path) AS (
+                        SELECT id, parentId, '/' || name FROM Folders WHERE parentId IS NULL OR parentId <= 0 OR parentId NOT IN (SELECT id FROM Folders)
+                        UNION ALL
+                        SELECT f.id, f.parentId, t.path || '/' || f.name FROM Folders AS f JOIN Tree AS t ON f.parentId = t.id
+                    ) SELECT id, parentId, path FROM Tree;"""
+                for row in self.conn.execute(query):
+                    names[row['id']] = row['path']
+                    children.setdefault(row['parentId'], []).append(row['id'])
+                self.folderTree = (names, dict([(name, id) for (id, name) in names.items()]), children)
+            return self.folderTree
+
+        def getFolders(self):
+            return self.getFolderTree()[0]
+
+        def getSubfolders(self, folder):
+            """Returns the ids of all folders below folder, at any depth."""
+            children = self.getFolderTree()[2]
+            subfolders = []
+            pending = list(children.get(folder, []))
+            while pending:
+                subfolders.append(pending.pop())
+                pending.extend(children.get(subfolders[-1], []))
+            return subfolders
+
+        def getGroups(self):
+            rows = self.conn.execute('SELECT * FROM Groups WHERE id != 0;').fetchall()
+            names = {0: '<no group>'}
+            for row in rows:
+                names[row['id']] = row['name']
+            return names
+
+        def getFolderID(self, identifier):
+            (names, ids, children) = self.getFolderTree()
+            if identifier.isdigit():
+                return int(identifier) if int(identifier) in names else None
+            return ids.get(identifier)
+            
+        def getGroupID(self, identifier):
+            if identifier.isdigit():
+                matches = lambda id, item: int(id) == int(item[0])
+            else:
+                matches = lambda id, item: id == item[1]
+            for group in self.getGroups().items():
+                if matches(identifier, group):
+                    return group[0]
+            return None
+
+        def prefetchRelated(self, condition, params):
+            """
+            Loads the rows of all related tables for the documents matching condition (a WHERE clause on Documents
+            AS d) using a single query per table. The rows are indexed by documentId, so that the document getters
+            below can answer from memory in stead of querying the database for every entry.
+            """
+            self.related = {}
+            for table in self.relatedTables:
+                rows = {}
+                query = 'SELECT * FROM %s WHERE documentId IN (SELECT d.id FROM Documents AS d WHERE %s);' % (table, condition)
+                for row in self.conn.execute(query, params):
+                    rows.setdefault(row['documentId'], []).append(row)
+                self.related[table] = rows
+            log.debug('Prefetched %s' % ', '.join(['%d documents with %s' % (len(rows), table) for (table, rows) in self.related.items()]))
+
+        def getRelated(self, table, entry):
+            if self.related is not None:
+                return self.related[table].get(entry['id'], [])
+            return self.conn.execute('SELECT * FROM %s WHERE documentId=?' % table, [entry['id']]).fetchall()
+
+        def getFingerprint(self, entry):
+            """
+            Returns a digest of the entry and all of its related rows (contributors, tags, keywords and URLs),
+            which changes whenever anything that could end up in the converted entry is modified. Mendeley Desktop
+            updates the modified column of a document whenever it edits one of its fields, so that is all we need of
+            the entry itself, besides the citation key, which may have been generated.
+            """
+            import hashlib
+            if entry.get('modified') is not None:
+                state = [entry['citationKey'], entry['modified']]
+            else:
+                state = [entry.values]
+            for table in self.relatedTables:
+                state.append([row.values for row in self.getRelated(table, entry)])
+            return hashlib.sha1(repr(state).encode('utf-8')).hexdigest()
+
+        def getDocumentContributors(self, entry, type):
+            if self.related is not None:
+                return [row for row in self.getRelated('DocumentContributors', entry) if row['contribution'] == type]
+            return self.conn.execute('SELECT * FROM DocumentContributors WHERE contribution=? AND documentId=?', [type, entry['id']]).fetchall()
+
+        def getTags(self, entry):
+            return self.getRelated('DocumentTags', entry)
+
+        def getKeywords(self, entry):
+            return self.getRelated('DocumentKeywords', entry)
+
+        def getURL(self, entry):
+            if self.related is not None:
+                urls = self.getRelated('DocumentUrls', entry)
+                url = urls[0] if urls else None
+            else:
+                url = self.conn.execute('SELECT * FROM DocumentUrls WHERE documentId=? LIMIT 1', [entry['id']]).fetchone()
+            return self.fixString(url['url']) if url else None
+
+        def getURLs(self, entry):
+            if self.related is not None:
+                urls = self.getRelated('DocumentUrls', entry)
+            else:
+                urls = self.conn.execute('SELECT * FROM DocumentUrls WHERE documentId=?', [entry['id']]).fetchall()
+            return [self.fixString(url['url']) for url in urls] if urls else []
+
+        def fixString(self, input):
+            if not isinstance(input, str):
+                return input.decode("utf-8")
+            return input
+
+def compileTemplate(template):
+    """
+    Compiles a string.Template into a %-style format string, and the list of placeholder names in the order in which
+    their values should be given to it.
+    """
+    names = []
+    parts = []
+    position = 0
+    for match in template.pattern.finditer(template.template):
+        parts.append(template.template[position:match.start()].replace('%', '%%'))
+        position = match.end()
+        if match.group('escaped') is not None:
+            parts.append(template.delimiter.replace('%', '%%'))
+        elif match.group('named') is not None or match.group('braced') is not None:
+            names.append(match.group('named') or match.group('braced'))
+            parts.append('%s')
+        else:
+            raise ValueError('Invalid placeholder in template: %s' % template.template)
+    parts.append(template.template[position:].replace('%', '%%'))
+    return (''.join(parts), names)
+
+"""
+'Abstract' class which should be extended by all converter classes to convert a list of entries into an output string.
+Has access to an opened Mendeley2Bib.openDatabase class.
+"""
+class MendeleyEntryConverter:
+    db = None
+    # Optional EntryCache holding previously converted entries
+    cache = None
+    # Cached entries are invalidated whenever the source of the converter changes (see getVersion); bump this to
+    # invalidate them for changes elsewhere, e.g. in data the converter reads from other files
+    version = 1
+    # Keyword arguments that construct an equivalent converter in a worker process (see iterConvertEntriesParallel)
+    options = {}
+    # Per Mendeley type lists of (key, extractor) pairs, see getFieldPlan
+    fieldPlans = None
+    # Optional Profiler recording the time spent per field
+    profiler = None
+    # Documents columns that are always read, besides those named in commonEntries, entryMap and entryTemplate;
+    # modified is part of the fingerprint of cached entries
+    requiredColumns = ['id', 'type', 'citationKey', 'title', 'year', 'modified']
+    # Documents columns read by the functions in commonEntries and entryMap. When None, they are unknown and all
+    # columns are read; subclasses should list them to let the database skip reading the others, either as a list, or
+    # as a dict of output keys to the columns read for them, so that the columns of unselected keys are skipped too.
+    # As long as a dict lacks the key of a function member, all columns are read, so that it can read anything.
+    functionColumns = None
+    # Related tables that are always read, as they are needed to generate absent citation keys
+    requiredTables = ['DocumentContributors']
+    # Related tables read by the functions in commonEntries and entryMap, as a dict of output keys to table names.
+    # When None, or when it lacks the key of a function member, all of openDatabase.relatedTables are read.
+    functionTables = None
+
+    def __init__(self, database, includeFields=None, excludeFields=None):
+        """
+        includeFields and excludeFields are lists of output keys to limit the members of the entries to. Unselected
+        members are not only left out of the output, but the columns and related tables they need are not read.
+        """
+        self.db = database
+        # number of entries skipped or lacking data while converting, see convertEntry
+        self.counters = Counter({'entries.skipped.unknownType': 0})
+        self.includeFields = set(includeFields) if includeFields is not None else None
+        self.excludeFields = set(excludeFields) if excludeFields is not None else None
+        self.entryTemplate = Template(self.entryTemplate)
+        self.entryMemberTemplate = Template(self.entryMemberTemplate)
+        # the templates are compiled into %-style format strings, which are filled in by buildEntry without having to
+        # build a mapping for every entry and member
+        (self.entryFormat, self.entryNames) = compileTemplate(self.entryTemplate)
+        (self.entryMemberFormat, memberNames) = compileTemplate(self.entryMemberTemplate)
+        self.entryMemberIndices = tuple([['key', 'value'].index(name) for name in memberNames])
+
+    def convertEntries(self, entryset, jobs=1):
+        entries = list(self.iterConvertEntries(entryset, jobs))
+        return (len(entries), ''.join(entries))
+
+    def iterConvertEntries(self, entryset, jobs=1):
+        """Lazily converts entries from any iterable, yielding the output of each entry that could be converted."""
+        for (entry, output) in self.iterConvertedEntries(entryset, jobs):
+            yield output
+
+    def iterConvertedEntries(self, entryset, jobs=1):
+        """Like iterConvertEntries, but yields (entry, output) pairs."""
+        if jobs > 1:
+            for converted in self.iterConvertEntriesParallel(entryset, jobs):
+                yield converted
+            return
+        convert = self.convertCachedEntry if self.cache is not None else self.convertEntry
+        for entry in entryset:
+            output = convert(entry)
+            if output:
+                yield (entry, output)
+
+    def iterConvertEntriesParallel(self, entryset, jobs, batchSize=250):
+        """
+        Like iterConvertedEntries, but distributes batches of entries over a pool of jobs worker processes.
+        Each batch carries the related rows of its entries, so that the workers need no database connection of their own.
+        Results are yielded in the original order of the entries, so the output is identical to that of a serial run.
+        """
+        import multiprocessing
+        from collections import deque
+        pool = multiprocessing.Pool(jobs, initializer=_initWorker, initargs=(self.__class__, self.options))
+        pending = deque()
+        workers = {}
+        try:
+            def collect():
+                (batch, fingerprints, outputs, result) = pending.popleft()
+                (pid, count, elapsed, converted, counters) = result.get()
+                self.counters.update(counters)
+                stats = workers.setdefault(pid, [0, 0.0])
+                stats[0] += count
+                stats[1] += elapsed
+                # outputs holds the cached entries; fill in the gaps with those converted by the worker
+                converted = iter(converted)
+                for (i, output) in enumerate(outputs):
+                    if output is None:
+                        outputs[i] = output = next(converted)
+                        if output and self.cache is not None:
+                            self.cache.put(batch[i]['id'], fingerprints[i], output)
+                return [(entry, output) for (entry, output) in zip(batch, outputs) if output]
+            for batch in self.iterBatches(entryset, batchSize):
+                if self.cache is not None:
+                    fingerprints = [self.db.getFingerprint(entry) for entry in batch]
+                    outputs = [self.cache.get(entry['id'], fingerprint) for (entry, fingerprint) in zip(batch, fingerprints)]
+                else:
+                    fingerprints = None
+                    outputs = [None] * len(batch)
+                todo = [entry for (entry, output) in zip(batch, outputs) if output is None]
+                related = dict([(table, dict([(entry['id'], self.db.getRelated(table, entry)) for entry in todo])) for table in self.db.relatedTables])
+                pending.append((batch, fingerprints, outputs, pool.apply_async(_convertBatch, [(todo, related)])))
+                # keep a bounded number of batches in flight, and emit finished ones in order
+                while len(pending) > 2 * jobs or (pending and pending[0][3].ready()):
+                    for converted in collect():
+                        yield converted
+            while pending:
+                for converted in collect():
+                    yield converted
+        finally:
+            pool.terminate()
+            pool.join()
+        for (pid, (count, elapsed)) in sorted(workers.items()):
+            log.info('Worker %d converted %d entries in %.2fs (%.0f entries/s)' % (pid, count, elapsed, count / elapsed if elapsed else 0))
+
+    def iterBatches(self, entryset, batchSize):
+        batch = []
+        for entry in entryset:
+            batch.append(entry)
+            if len(batch) == batchSize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def getVersion(self):
+        """
+        Identifies the converter and latex table that produce the output, used to invalidate cached entries.
+        Includes a digest of the source of the modules defining the converter and its base classes, and of the
+        latex module, so that any change to e.g. entryMap, entryTemplate, the field functions or the escaping of
+        characters invalidates the entries it converted.
+        """
+        import hashlib
+        import inspect
+        import latex
+        digest = hashlib.sha1()
+        for cls in self.__class__.__mro__[:-1]:
+            try:
+                digest.update(inspect.getsource(sys.modules[cls.__module__]).encode('utf-8'))
+            except (KeyError, OSError, TypeError):
+                # no source available, e.g. when defined interactively; fall back to the version attribute
+                digest.update(cls.__qualname__.encode('utf-8'))
+        try:
+            digest.update(inspect.getsource(latex).encode('utf-8'))
+        except (OSError, TypeError):
+            pass
+        version = '%s.%s/%d/%s/latex:%s' % (self.__class__.__module__, self.__class__.__name__, self.version, digest.hexdigest()[:12], latex.tableVersion())
+        if self.includeFields is not None or self.excludeFields is not None:
+            version = '%s/fields:%s' % (version, ','.join(sorted([key for key in self.getFieldNames() if self.isFieldSelected(key)])))
+        return version
+
+    def convertCachedEntry(self, entry):
+        fingerprint = self.db.getFingerprint(entry)
+        output = self.cache.get(entry['id'], fingerprint)
+        if output is None:
+            output = self.convertEntry(entry)
+            if output:
+                self.cache.put(entry['id'], fingerprint, output)
+        return output
+
+    def writeEntries(self, entryset, stream, jobs=1):
+        """Converts entries and writes each one to stream as soon as it is produced. Returns the number of converted entries."""
+        count = 0
+        for output in self.iterConvertEntries(entryset, jobs):
+            stream.write(output)
+            count += 1
+        return count
+
+    def buildEntry(self, entry, entryType, members):
+        memberFormat = self.entryMemberFormat
+        if self.entryMemberIndices == (0, 1):
+            entryMembers = self.entryMemberSeparator.join([memberFormat % member for member in members])
+        else:
+            indices = self.entryMemberIndices
+            entryMembers = self.entryMemberSeparator.join([memberFormat % tuple([member[i] for i in indices]) for member in members])
+        values = []
+        for name in self.entryNames:
+            if name == 'entryType':
+                values.append(entryType)
+            elif name == 'members':
+                values.append(entryMembers)
+            else:
+                values.append(entry[name])
+        return self.entryFormat % tuple(values)
+
+    def isFieldSelected(self, key):
+        """Returns whether the member with output key key is written, according to includeFields and excludeFields."""
+        return (self.includeFields is None or key in self.includeFields) and (self.excludeFields is None or key not in self.excludeFields)
+
+    def getFields(self, entrytype=None):
+        """Returns the selected items of commonEntries and entryMap for a Mendeley type, or for all types if None."""
+        if entrytype is None:
+            fields = self.commonEntries + [e for fields in self.entryMap.values() for e in fields]
+        else:
+            fields = self.commonEntries + self.entryMap.get(entrytype, [])
+        return [e for e in fields if self.isFieldSelected(e[0] if isinstance(e, tuple) else e)]
+
+    def getFieldNames(self):
+        """Returns the output keys of all members this converter can write."""
+        return set([e[0] if isinstance(e, tuple) else e for e in self.commonEntries + [e for fields in self.entryMap.values() for e in fields]])
+
+    def getFunctionKeys(self):
+        """Returns the output keys of the selected members that are obtained by calling a function."""
+        return set([e[0] for e in self.getFields() if isinstance(e, tuple) and not isinstance(e[1], str)])
+
+    def getColumns(self):
+        """Returns the Documents columns this converter needs, or None if it needs all of them."""
+        if self.functionColumns is None:
+            return None
+        columns = set(self.requiredColumns)
+        if isinstance(self.functionColumns, dict):
+            undeclared = self.getFunctionKeys() - set(self.functionColumns)
+            if undeclared:
+                log.debug('Reading all columns, as functionColumns does not declare those read for %s' % ', '.join(sorted(undeclared)))
+                return None
+            for (key, names) in self.functionColumns.items():
+                if self.isFieldSelected(key):
+                    columns.update(names)
+        else:
+            columns.update(self.functionColumns)
+        for e in self.getFields():
+            if not isinstance(e, tuple):
+                columns.add(e)
+            elif isinstance(e[1], str):
+                columns.add(e[1])
+        columns.update([name for name in self.entryNames if name not in ('entryType', 'members')])
+        return sorted(columns)
+
+    def getRelatedTables(self):
+        """Returns the related tables this converter needs, or None if it needs all of them."""
+        if self.functionTables is None:
+            return None
+        undeclared = self.getFunctionKeys() - set(self.functionTables)
+        if undeclared:
+            log.debug('Reading all related tables, as functionTables does not declare those read for %s' % ', '.join(sorted(undeclared)))
+            return None
+        tables = set(self.requiredTables)
+        for (key, names) in self.functionTables.items():
+            if self.isFieldSelected(key):
+                tables.update(names)
+        return [table for table in self.db.relatedTables if table in tables]
+
+    def setProfiler(self, profiler):
+        """Records the time spent per field in profiler from now on."""
+        self.profiler = profiler
+        self.fieldPlans = None
+
+    def getFieldPlan(self, entrytype):
+        """
+        Returns the list of (key, extractor) pairs that make up the members of an entry of the given Mendeley type.
+        The plan is compiled from commonEntries and entryMap on first use, so the decisions on how to obtain each
+        member are made once per type rather than once per entry.
+        """
+        if self.fieldPlans is None:
+            self.fieldPlans = {}
+        if entrytype not in self.fieldPlans:
+            plan = [self.compileField(e) for e in self.getFields(entrytype)]
+            if self.profiler is not None:
+                plan = [(key, self.profiler.wrap('field %s' % key, extract)) for (key, extract) in plan]
+            self.fieldPlans[entrytype] = plan
+        return self.fieldPlans[entrytype]
+
+    def compileField(self, e):
+        if isinstance(e, tuple):
+            if isinstance(e[1], str):
+                # mapped simply to another variable
+                return (e[0], self.compileColumn(e[1]))
+            # mapped to a function (we hope)
+            return e
+        # 1-to-1 relation
+        return (e, self.compileColumn(e))
+
+    def compileColumn(self, column):
+        process = self.processGenericEntry
+        def extract(entry):
+            raw = entry.get(column)
+            if type(raw) == bytes:
+                raw = raw.decode('UTF-8')
+            return process(raw)
+        return extract
+
+    def convertEntry(self, entry):
+        entrytype = entry['type']
+        citationKey = entry['citationKey']
+        log.debug('Processing entry \'%s\'' % citationKey)
+        if not entrytype in self.entryTypeMap:
+            log.warning('No conversion available for entry type \'%s\'! Entry \'%s\' will not be available in your .bib file.' % (entry['type'], citationKey or entry['title']))
+            self.counters['entries.skipped.unknownType'] += 1
+            return None
+        outputEntryType = self.entryTypeMap[entrytype]
+        outputEntries = []
+        for (key, extract) in self.getFieldPlan(entrytype):
+            value = extract(entry)
+            if value is not None:
+                outputEntries.append((key, value))
+        return self.buildEntry(entry, outputEntryType, outputEntries)
+
+
+# Converter used by a worker process of MendeleyEntryConverter.iterConvertEntriesParallel
+_workerConverter = None
+
+def _initWorker(converterClass, options):
+    global _workerConverter
+    _workerConverter = converterClass(Mendeley2Bib.openDatabase(None), **options)
+
+def _convertBatch(job):
+    """Converts a batch of entries in a worker process, answering all lookups of related rows from the batch itself."""
+    (entries, related) = job
+    start = time.time()
+    _workerConverter.db.related = related
+    _workerConverter.counters = Counter()
+    outputs = [_workerConverter.convertEntry(entry) for entry in entries]
+    return (os.getpid(), len(entries), time.time() - start, outputs, _workerConverter.counters)
+
+def exportDatabase(job):
+    """
+    Exports a single database to its own output file in a worker process, using a connection of its own.
+    Returns the name of the database, the number of converted entries, whether the output file was written, the time
+    taken, and an error message or None.
+    """
+    (name, mendeleyFolder, options) = job
+    from bibconverter import BibConverter
+    start = time.time()
+    db = Mendeley2Bib.openDatabase(name, prefetch=options['prefetch'], snapshot=options['snapshot'])
+    db.mendeleyFolder = mendeleyFolder
+    try:
+        with db:
+            folderID = None
+            if options['folder']:
+                folderID = db.getFolderID(options['folder'])
+                if folderID is None:
+                    return (name, 0, False, time.time() - start, 'folder \'%s\' not found' % options['folder'])
+            groupID = None
+            if options['group']:
+                groupID = db.getGroupID(options['group'])
+                if groupID is None:
+                    return (name, 0, False, time.time() - start, 'group \'%s\' not found' % options['group'])
+            converter = BibConverter(db, encodingCacheSize=options['encodingCacheSize'], utf8=options['utf8'], includeFields=options['includeFields'], excludeFields=options['excludeFields'])
+            db.relatedTables = converter.getRelatedTables() or db.relatedTables
+            entries = db.getEntries(folder=folderID, group=groupID, onlyFavourites=options['onlyFavourites'], writebackKeys=options['writebackKeys'], columns=converter.getColumns(), recursive=options['recursive'], citationKeys=options['citationKeys'], entryTypes=converter.entryTypeMap)
+            output = AtomicOutput(options['output'].replace('{db}', name))
+            try:
+                numConverted = converter.writeEntries(entries, output)
+                output.write('\n')
+            except:
+                output.discard()
+                raise
+            return (name, numConverted, output.close(), time.time() - start, None)
+    except Exception as e:
+        log.exception('Failed to export database %s' % name)
+        return (name, 0, False, time.time() - start, str(e))
+
+def writeReport(report, filename, db, converter, sqlProfiler=None):
+    """
+    Completes report with the counters of db and converter, the SQL statements recorded by sqlProfiler and the cache
+    hit rates, and writes it to filename: in the Prometheus text format when it ends in .prom, and as JSON otherwise.
+    """
+    report.update(db.counters)
+    report.update(converter.counters)
+    if sqlProfiler is not None:
+        report.addSQL(sqlProfiler)
+    if converter.cache is not None:
+        report.setRate('cache.entries', converter.cache.hits, converter.cache.misses)
+    if hasattr(converter, 'encode'):
+        (hits, misses) = converter.encode.cache_info()[:2]
+        report.setRate('cache.encoding', hits, misses)
+    writeIfChanged(filename, report.formatPrometheus() if filename.endswith('.prom') else report.formatJSON())
+
+def writeFolderOutputs(db, converter, entryset, directory, jobs=1, recursive=False):
+    """
+    Converts each entry once, and writes one .bib file per Mendeley folder into directory, holding the entries of the
+    documents in that folder, and when recursive is set, in its subfolders. The files are laid out like the folder
+    tree, e.g. /Thesis/Chapter 1 is written to Thesis/Chapter 1.bib. Files whose contents did not change are left
+    untouched. Returns the number of converted entries and the number of files written.
+    """
+    memberships = db.getFolderMemberships()
+    if recursive:
+        # a document in a folder is also in all of the folders above it
+        ancestors = {}
+        for folder in db.getFolders():
+            if folder == 0:
+                # '/' stands for the unsorted documents, not a folder holding all others
+                continue
+            for subfolder in db.getSubfolders(folder):
+                ancestors.setdefault(subfolder, []).append(folder)
+        for (document, folders) in memberships.items():
+            memberships[document] = set(folders + [ancestor for folder in folders for ancestor in ancestors.get(folder, [])])
+    outputs = {}
+    numConverted = 0
+    for (entry, output) in converter.iterConvertedEntries(entryset, jobs):
+        numConverted += 1
+        for folder in memberships.get(entry['id'], []):
+            outputs.setdefault(folder, []).append(output)
+    numWritten = 0
+    for (folder, name) in db.getFolders().items():
+        if folder not in outputs:
+            continue
+        filename = os.path.join(directory, *[re.sub(r'[<>:"/\\|?*\x00-\x1f]', '_', part) for part in name.split('/')[1:]])
+        filename = '%s.bib' % filename
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        if writeIfChanged(filename, '%s\n' % ''.join(outputs[folder])):
+            log.info('Wrote %d entries of folder %s to %s' % (len(outputs[folder]), name, filename))
+            numWritten += 1
+        else:
+            log.debug('Entries of folder %s did not change, %s left untouched' % (name, filename))
+    return (numConverted, numWritten)
+
+def getFileMode(filename):
+    """Returns the permissions filename has, or the default permissions for a new file if it does not exist yet."""
+    try:
+        return os.stat(filename).st_mode & 0o777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def writeIfChanged(filename, content):
+    """
+    Writes content to filename, unless the file already holds exactly that content. The file is replaced atomically
+    through a temporary file in the same folder, so readers never see a partially written file.
+    Returns whether the file was written.
+    """
+    try:
+        with io.open(filename, 'r', encoding='utf-8', newline='') as f:
+            if f.read() == content:
+                return False
+    except (IOError, OSError, UnicodeDecodeError):
+        pass
+    import tempfile
+    (fd, tempname) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix='.%s.' % os.path.basename(filename))
+    try:
+        with io.open(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        os.chmod(tempname, getFileMode(filename))
+        os.replace(tempname, filename)
+    except:
+        os.remove(tempname)
+        raise
+    return True
+
+"""
+A text stream that writes to a temporary file next to filename, keeping a running hash of everything written. Closing
+it replaces filename with the temporary file, unless filename already holds exactly the same content; then it is left
+untouched, so tools like latexmk that watch its modification time do not rebuild for nothing.
+"""
+class AtomicOutput:
+    def __init__(self, filename):
+        import hashlib
+        self.filename = filename
+        self.hash = hashlib.sha1()
+        self.size = 0
+        import tempfile
+        (fd, self.tempname) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix='.%s.' % os.path.basename(filename))
+        self.stream = io.open(fd, 'wb')
+
+    def write(self, data):
+        data = data.encode('utf-8')
+        self.hash.update(data)
+        self.size += len(data)
+        self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isUnchanged(self):
+        try:
+            if os.path.getsize(self.filename) != self.size:
+                return False
+            import hashlib
+            existing = hashlib.sha1()
+            with io.open(self.filename, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 16), b''):
+                    existing.update(block)
+            return existing.digest() == self.hash.digest()
+        except (IOError, OSError):
+            return False
+
+    def close(self):
+        """Puts the written content in place if it changed, and returns whether it did."""
+        self.stream.close()
+        if self.isUnchanged():
+            os.remove(self.tempname)
+            return False
+        try:
+            os.chmod(self.tempname, getFileMode(self.filename))
+            os.replace(self.tempname, self.filename)
+        except:
+            os.remove(self.tempname)
+            raise
+        return True
+
+    def discard(self):
+        """Throws away the written content, leaving filename untouched."""
+        self.stream.close()
+        os.remove(self.tempname)
+
+def getFileState(filenames):
+    """Returns the size and modification time of each of the given files, or None for those that do not exist."""
+    state = []
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+            state.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            state.append(None)
+    return tuple(state)
+
+def watchDatabase(db, export, interval=2.0, settle=2.0, extraState=None):
+    """
+    Calls export() once, and then again every time the database changes, until interrupted.
+    Bursts of writes are debounced: export() is only called once the database has not changed for settle seconds.
+    When given, the value returned by extraState() is watched as well, e.g. for the files an export reads.
+    """
+    getState = lambda: (db.getChangeState(), extraState() if extraState is not None else None)
+    lastState = None
+    try:
+        while True:
+            state = getState()
+            if state != lastState:
+                if lastState is not None:
+                    while True:
+                        time.sleep(settle)
+                        settledState = getState()
+                        if settledState == state:
+                            break
+                        state = settledState
+                export()
+                lastState = state
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
@@ -10,6 +10,14 @@ are both available just by letting "import latex" find this file.
  - ustring.decode('latex+latin1')
 where latin1 can be replaced by any other known encoding, also
 become available by calling latex.register().
+ - latex_encode(ustring)
+ - latex_decode(string)
+do the same as the plain 'latex' codec, without going through codecs.
+ - latex_escape(ustring)
+only escapes % # & and control characters, and keeps all other unicode
+characters as they are, for UTF-8 aware tools like biber. Like with
+latex_encode, LaTeX markup such as {DNA}, $\\alpha$ or \\emph{} passes
+through unchanged.
 
 We also make public a dictionary latex_equivalents,
 mapping ord(unicode char) to LaTeX code.
@@ -22,12 +30,27 @@ Quickly hack-ported to Python3 by rem (sorry in advance)
 import codecs
 import re
 
+_registered = False
+
 def register():
     """Enable encodings of the form 'latex+x' where x describes another encoding.
     Unicode characters are translated to or from x when possible, otherwise
-    expanded to latex.
+    expanded to latex. Calling this more than once has no further effect.
     """
-    codecs.register(_registry)
+    global _registered
+    if not _registered:
+        codecs.register(_registry)
+        _registered = True
+
+_tableVersion = None
+
+def tableVersion():
+    """Return a digest of latex_equivalents, which changes whenever the translation table does."""
+    global _tableVersion
+    if _tableVersion is None:
+        import hashlib
+        _tableVersion = hashlib.sha1(repr(sorted(latex_equivalents.items())).encode('utf-8')).hexdigest()[:12]
+    return _tableVersion
 
 def getregentry():
     """Encodings module API."""
@@ -44,6 +67,8 @@ def _registry(encoding):
     class Codec(codecs.Codec):
         def encode(self,input,errors='strict'):
             """Convert unicode string to latex."""
+            if not encoding:
+                return latex_encode(input).encode('ASCII'), len(input)
             output = []
             for c in input:
                 if encoding:
@@ -63,13 +88,9 @@ def _registry(encoding):
             if encoding:
                 input = str(input,encoding,errors)
 
-            # Note: we may get buffer objects here.
-            # It is not permussable to call join on buffer objects
-            # but we can make them joinable by calling unicode.
-            # This should always be safe since we are supposed
-            # to be producing unicode output anyway.
-            x = map(str,_unlatex(input))
-            return ''.join(x), len(input)
+            elif not isinstance(input, str):
+                input = str(input,'ASCII',errors)
+            return latex_decode(input), len(input)
 
     class StreamWriter(Codec,codecs.StreamWriter):
         pass
@@ -79,118 +100,120 @@ def _registry(encoding):
 
     return (Codec().encode,Codec().decode,StreamReader,StreamWriter)
 
+class _EncodingTable(dict):
+    """str.translate table from latex_equivalents; characters without an equivalent
+    are turned into \\char escapes on first use and remembered from then on.
+    """
+    def __missing__(self,c):
+        self[c] = '{\\char%d}' % c
+        return self[c]
+
+# ASCII characters that are not output as-is by latex_encode
+_asciiSpecials = re.compile('[\x00-\x09\x0b-\x1f#&\x7f]')
+
+def latex_encode(text):
+    """Convert unicode string to latex, giving the same result as the 'latex' codec
+    without going through the codecs machinery or looping over characters in Python.
+    """
+    if text.isascii() and not _asciiSpecials.search(text):
+        return text
+    return text.translate(_encodingTable)
+
+# Characters escaped by latex_escape, apart from control characters, which are handled like latex_encode does
+_escapeSpecials = re.compile('[\x00-\x09\x0b-\x1f\x7f%#&]')
+
+def latex_escape(text):
+    """Escape % # & and control characters in a unicode string, leaving everything
+    else, including non-ASCII characters and LaTeX markup, as it is.
+    """
+    if not _escapeSpecials.search(text):
+        return text
+    # special characters are rare, so substituting them one by one beats translating every character
+    return _escapeSpecials.sub(_escapeMatch, text)
+
+def _escapeMatch(match):
+    return _escapeTable[match.group()]
+
+# Single-pass tokenizer. Control words swallow the blanks after them (except \char123 and \accent123),
+# and runs of uninteresting characters become a single token, apart from their first character,
+# which may still be the argument of a preceding accent, as in \"a.
+_tokens = re.compile(r"""
+    [\x00-\x08\x0b\x0c\x0e-\x1f\x7f]+               # control characters are dropped
+  | (\\(?:char|accent)\d+)
+  | (\\(?:[^\W\d_]+|.)?)\s*
+  | (\$\$|/~|\d+|-+
+    |(?<=[^\s\x00-\x1f!$\-/?{}~\\`'\x7f])(?<!\\.)[^\x00-\x08\x0b\x0c\x0e-\x1f!$\-/?{}~\\`'\x7f]+
+    |.)
+""", re.VERBOSE | re.DOTALL)
+
 def _tokenize(tex):
-    """Convert latex source into sequence of single-token substrings."""
-    start = 0
-    try:
-        # skip quickly across boring stuff
-        pos = next(_stoppers.finditer(str(tex))).span()[0]
-    except StopIteration:
-        yield tex
-        return
-
-    while 1:
-        if pos > start:
-            yield tex[start:pos]
-            if tex[start] == '\\' and not (tex[pos-1].isdigit() and tex[start+1].isalpha()):
-                while pos < len(tex) and tex[pos].isspace(): # skip blanks after csname
-                    pos += 1
-
-        while pos < len(tex) and tex[pos] in _ignore:
-            pos += 1    # flush control characters
-        if pos >= len(tex):
-            return
-        start = pos
-        if tex[pos:pos+2] in {'$$':None, '/~':None}:    # protect ~ in urls
-            pos += 2
-        elif tex[pos].isdigit():
-            while pos < len(tex) and tex[pos].isdigit():
-                pos += 1
-        elif tex[pos] == '-':
-            while pos < len(tex) and tex[pos] == '-':
-                pos += 1
-        elif tex[pos] != '\\' or pos == len(tex) - 1:
-            pos += 1
-        elif not tex[pos+1].isalpha():
-            pos += 2
-        else:
-            pos += 1
-            while pos < len(tex) and tex[pos].isalpha():
-                pos += 1
-            if tex[start:pos] == '\\char' or tex[start:pos] == '\\accent':
-                while pos < len(tex) and tex[pos].isdigit():
-                    pos += 1
-
-class _unlatex:
-    """Convert tokenized tex into sequence of unicode strings.  Helper for decode()."""
-
-    def __iter__(self):
-        """Turn self into an iterator.  It already is one, nothing to do."""
-        return self
-
-    def __init__(self,tex):
-        """Create a new token converter from a string."""
-        self.tex = tuple(_tokenize(tex))  # turn tokens into indexable list
-        self.pos = 0                    # index of first unprocessed token
-        self.lastoutput = 'x'           # lastoutput must always be nonempty string
-
-    def __getitem__(self,n):
-        """Return token at offset n from current pos."""
-        p = self.pos + n
-        t = self.tex
-        return p < len(t) and t[p] or None
-
-    def __next__(self):
-        """Find and return another piece of converted output."""
-        if self.pos >= len(self.tex):
-            raise StopIteration
-        nextoutput = self.chunk()
-        if self.lastoutput[0] == '\\' and self.lastoutput[-1].isalpha() and nextoutput[0].isalpha():
-            nextoutput = ' ' + nextoutput   # add extra space to terminate csname
-        self.lastoutput = nextoutput
-        return nextoutput
-
-    def chunk(self):
-        """Grab another set of input tokens and convert them to an output string."""
-        for delta,c in self.candidates(0):
-            if c in _l2u:
-                self.pos += delta
-                return unichr(_l2u[c])
-            elif len(c) == 2 and c[1] == 'i' and (c[0],'\\i') in _l2u:
-                self.pos += delta       # correct failure to undot i
-                return unichr(_l2u[(c[0],'\\i')])
-            elif len(c) == 1 and c[0].startswith('\\char') and c[0][5:].isdigit():
-                self.pos += delta
-                return unichr(int(c[0][5:]))
-
-        # nothing matches, just pass through token as-is
-        self.pos += 1
-        return self[-1]
-
-    def candidates(self,offset):
-        """Generate pairs delta,c where c is a token or tuple of tokens from tex
-        (after deleting extraneous brackets starting at pos) and delta
-        is the length of the tokens prior to bracket deletion.
-        """
-        t = str(self[offset])
-        if t in _blacklist:
-            return
+    """Convert latex source into a list of tokens."""
+    return [a or b or c for (a, b, c) in _tokens.findall(tex) if a or b or c]
+
+def latex_decode(tex):
+    """Convert latex source string to unicode, in time linear in the length of tex."""
+    (blacklist, decodingTable) = _getDecodingTables()
+    tokens = _tokenize(tex)
+    n = len(tokens)
+    # closing[i] is the number of consecutive '}' tokens starting at token i, inner[i] is the first token at or after i
+    # that is not a '{' or \mbox, and opening[i] is the number of '{' tokens in between
+    closing = [0] * (n + 4)
+    inner = list(range(n + 4))
+    opening = [0] * (n + 4)
+    for i in range(n - 1, -1, -1):
+        t = tokens[i]
+        if t == '}':
+            closing[i] = closing[i + 1] + 1
         elif t == '{':
-            for delta,c in self.candidates(offset+1):
-                if self[offset+delta+1] == '}':
-                    yield delta+2,c
+            inner[i] = inner[i + 1]
+            opening[i] = opening[i + 1] + 1
         elif t == '\\mbox':
-            for delta,c in self.candidates(offset+1):
-                yield delta+1,c
-        elif t == '$' and self[offset+2] == '$':
-            yield 3, (t,self[offset+1],t)
-        else:
-            q = self[offset+1]
-            if q == '{' and self[offset+3] == '}':
-                yield 4, (t,self[offset+2])
-            elif q:
-                yield 2, (t,q)
-            yield 1, t
+            inner[i] = inner[i + 1]
+            opening[i] = opening[i + 1]
+    tokens.extend([None] * 4)   # saves bounds checks when looking ahead
+
+    output = []
+    lastoutput = 'x'            # lastoutput must always be nonempty string
+    pos = 0
+    while pos < n:
+        (delta, nextoutput) = _translate(tokens, closing, inner[pos], opening[pos], inner[pos] - pos, blacklist, decodingTable)
+        if nextoutput is None:
+            # nothing matches, just pass through token as-is
+            (delta, nextoutput) = (1, tokens[pos])
+        if lastoutput[0] == '\\' and lastoutput[-1].isalpha() and nextoutput[0].isalpha():
+            nextoutput = ' ' + nextoutput   # add extra space to terminate csname
+        output.append(nextoutput)
+        lastoutput = nextoutput
+        pos += delta
+    return ''.join(output)
+
+def _translate(tokens, closing, pos, braces, wrappers, blacklist, decodingTable):
+    """Find the translation of the tokens at pos, which are enclosed by the given number of
+    brackets and wrapped in a total number of brackets and \\mbox commands just before pos.
+    Returns the number of tokens it spans including the wrappers and the translated character,
+    or (0, None) when there is no translation.
+    """
+    t = tokens[pos]
+    if t is None or t[0] in blacklist:
+        return (0, None)
+    q = tokens[pos + 1]
+    if t == '$' and tokens[pos + 2] == '$':
+        candidates = [(3, (t, q, t))]
+    else:
+        candidates = []
+        if q == '{' and tokens[pos + 3] == '}':
+            candidates.append((4, (t, tokens[pos + 2])))
+        elif q:
+            candidates.append((2, (t, q)))
+        candidates.append((1, t))
+    for (delta, c) in candidates:
+        if closing[pos + delta] < braces:
+            continue
+        if c in decodingTable:
+            return (wrappers + braces + delta, decodingTable[c])
+        if delta == 1 and t.startswith('\\char') and t[5:].isdigit():
+            return (wrappers + braces + delta, chr(int(t[5:])))
+    return (0, None)
 
 latex_equivalents = {
     0x0009: ' ',
@@ -473,55 +496,71 @@ for _i in range(0x0020,0x007f):
     if _i not in latex_equivalents:
         latex_equivalents[_i] = chr(_i)
 
-# Characters that should be ignored and not output in tokenization
-_ignore = set([chr(i) for i in list(range(32))+[127]]) - set('\t\n\r')
+_encodingTable = _EncodingTable(latex_equivalents)
 
-# Regexp of chars not in blacklist, for quick start of tokenize
-_stoppers = re.compile('[\x00-\x1f!$\\-?\\{~\\\\`\']')
+# the same as latex_encode writes for these, apart from %, which it leaves alone
+_escapeTable = dict((chr(_i), _encodingTable[_i]) for _i in list(range(0x00, 0x20)) + [0x7f, ord('#'), ord('&')])
+_escapeTable['%'] = '\\%'
 
-_blacklist = set(' \n\r')
-_blacklist.add(None)    # shortcut candidate generation at end of data
+_decodingTables = None
 
-# Construction of inverse translation table
-_l2u = {
-    '\ ':ord(' ')   # unexpanding space makes no sense in non-TeX contexts
-}
-
-for _tex in latex_equivalents:
-    if _tex <= 0x0020 or (_tex <= 0x007f and len(latex_equivalents[_tex]) <= 1):
-        continue    # boring entry
-    _toks = tuple(_tokenize(latex_equivalents[_tex]))
-    if _toks[0] == '{' and _toks[-1] == '}':
-        _toks = _toks[1:-1]
-    if _toks[0].isalpha():
-        continue    # don't turn ligatures into single chars
-    if len(_toks) == 1 and (_toks[0] == "'" or _toks[0] == "`"):
-        continue    # don't turn ascii quotes into curly quotes
-    if _toks[0] == '\\mbox' and _toks[1] == '{' and _toks[-1] == '}':
-        _toks = _toks[2:-1]
-    if len(_toks) == 4 and _toks[1] == '{' and _toks[3] == '}':
-        _toks = (_toks[0],_toks[2])
-    if len(_toks) == 1:
-        _toks = _toks[0]
-    _l2u[_toks] = _tex
-
-# Shortcut candidate generation for certain useless candidates:
-# a character is in _blacklist if it can not be at the start
-# of any translation in _l2u.  We use this to quickly skip through
-# such characters before getting to more difficult-translate parts.
-# _blacklist is defined several lines up from here because it must
-# be defined in order to call _tokenize, however it is safe to
-# delay filling it out until now.
-
-for i in range(0x0020,0x007f):
-    _blacklist.add(chr(i))
-_blacklist.remove('{')
-_blacklist.remove('$')
-for candidate in _l2u:
-    if isinstance(candidate,tuple):
-        if not candidate or not candidate[0]:
-            continue
-        firstchar = candidate[0][0]
-    else:
-        firstchar = candidate[0]
-    _blacklist.discard(firstchar)
+def _getDecodingTables():
+    """Build the tables used by latex_decode on first use, so that importing this module for encoding stays cheap.
+    Returns (blacklist, decodingTable).
+    """
+    global _decodingTables
+    if _decodingTables is not None:
+        return _decodingTables
+
+    blacklist = set(' \n\r')
+
+    # Construction of inverse translation table
+    l2u = {
+        '\ ':ord(' ')   # unexpanding space makes no sense in non-TeX contexts
+    }
+
+    for tex in latex_equivalents:
+        if tex <= 0x0020 or (tex <= 0x007f and len(latex_equivalents[tex]) <= 1):
+            continue    # boring entry
+        toks = tuple(_tokenize(latex_equivalents[tex]))
+        if toks[0] == '{' and toks[-1] == '}':
+            toks = toks[1:-1]
+        if toks[0].isalpha():
+            continue    # don't turn ligatures into single chars
+        if len(toks) == 1 and (toks[0] == "'" or toks[0] == "`"):
+            continue    # don't turn ascii quotes into curly quotes
+        if toks[0] == '\\mbox' and toks[1] == '{' and toks[-1] == '}':
+            toks = toks[2:-1]
+        if len(toks) == 4 and toks[1] == '{' and toks[3] == '}':
+            toks = (toks[0],toks[2])
+        if len(toks) == 1:
+            toks = toks[0]
+        l2u[toks] = tex
+
+    # Shortcut candidate generation for certain useless candidates:
+    # a character is in blacklist if it can not be at the start
+    # of any translation in l2u.  We use this to quickly skip through
+    # such characters before getting to more difficult-translate parts.
+
+    for i in range(0x0020,0x007f):
+        blacklist.add(chr(i))
+    blacklist.remove('{')
+    blacklist.remove('$')
+    for candidate in l2u:
+        if isinstance(candidate,tuple):
+            if not candidate or not candidate[0]:
+                continue
+            firstchar = candidate[0][0]
+        else:
+            firstchar = candidate[0]
+        blacklist.discard(firstchar)
+
+    # Translations by token or tuple of tokens, as looked up by _translate.
+    # Tuples with a dotted i also match the dotless i version, to correct failure to undot i.
+    decodingTable = dict((toks, chr(tex)) for (toks, tex) in l2u.items())
+    for toks in l2u:
+        if isinstance(toks, tuple) and len(toks) == 2 and toks[1] == '\\i':
+            decodingTable.setdefault((toks[0], 'i'), chr(l2u[toks]))
+
+    _decodingTables = (blacklist, decodingTable)
+    return _decodingTables
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 *-*
+from __future__ import unicode_literals
+import re
+import sys
+import time
+
+"""
+Collects the number of calls and the total time spent per named activity during an export, e.g. per SQL statement
+or per field extractor, and prints a summary sorted by time.
+"""
+class Profiler:
+    def __init__(self):
+        self.timings = {}
+        self.start = time.time()
+
+    def add(self, name, elapsed, calls=1):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = [0, 0.0]
+        timing[0] += calls
+        timing[1] += elapsed
+
+    def wrap(self, name, function):
+        """Returns a version of function that records the time spent in it under name."""
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(name, time.time() - start)
+        return timed
+
+    def wrapConnection(self, conn):
+        return ProfiledConnection(conn, self)
+
+    def wrapStream(self, stream):
+        return ProfiledStream(stream, self)
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+        stream.write('\nProfile of %.3fs run, sorted by total time:\n' % (time.time() - self.start))
+        stream.write('%10s %10s  %s\n' % ('calls', 'total (s)', 'activity'))
+        for (name, (calls, elapsed)) in sorted(self.timings.items(), key=lambda timing: -timing[1][1]):
+            stream.write('%10d %10.3f  %s\n' % (calls, elapsed, name))
+
+"""
+Wraps a sqlite3 connection, recording the number of queries and the time spent executing and fetching per statement.
+"""
+class ProfiledConnection:
+    def __init__(self, conn, profiler):
+        self.conn = conn
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, type, value, traceback):
+        return self.conn.__exit__(type, value, traceback)
+
+    def execute(self, statement, *args):
+        return self.run(self.conn.execute, statement, args)
+
+    def executemany(self, statement, *args):
+        return self.run(self.conn.executemany, statement, args)
+
+    def run(self, method, statement, args):
+        name = 'SQL %s' % re.sub(r'\s+', ' ', statement).strip()
+        start = time.time()
+        try:
+            cursor = method(statement, *args)
+        finally:
+            self.profiler.add(name, time.time() - start)
+        return ProfiledCursor(cursor, self.profiler, name)
+
+"""
+Wraps a sqlite3 cursor, adding the time spent fetching rows to the statement that produced it.
+"""
+class ProfiledCursor:
+    def __init__(self, cursor, profiler, name):
+        self.cursor = cursor
+        self.profiler = profiler
+        self.name = name
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.fetch(self.cursor.__next__)
+
+    next = __next__
+
+    def fetchone(self):
+        return self.fetch(self.cursor.fetchone)
+
+    def fetchall(self):
+        return self.fetch(self.cursor.fetchall)
+
+    def fetch(self, method):
+        start = time.time()
+        try:
+            return method()
+        finally:
+            self.profiler.add(self.name, time.time() - start, calls=0)
+
+"""
+Wraps an output stream, recording the time spent writing to it.
+"""
+class ProfiledStream:
+    def __init__(self, stream, profiler):
+        self.stream = stream
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def write(self, data):
+        start = time.time()
+        try:
+            return self.stream.write(data)
+        finally:
+            self.profiler.add('output write', time.time() - start)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 *-*
+from __future__ import unicode_literals
+import re
+import json
+import time
+
+"""
+Collects the figures of a single export for monitoring: the number of entries read, converted and skipped per reason,
+generated citation keys, the time spent per stage, the number of SQL statements, the size of the output and the hit
+rates of the caches. Values are named with dotted paths like 'entries.skipped.unknownType', which become nested
+objects in the JSON report, and metric names like mendeley2bib_entries_skipped_unknown_type in the Prometheus text
+format (for node_exporter's textfile collector).
+"""
+class RunReport:
+    def __init__(self):
+        self.start = time.time()
+        self.values = {}
+        self.stages = {}
+        self.currentStage = None
+        self.stageStart = None
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def update(self, counters):
+        """Adds a dict of counts, such as the counters of openDatabase and MendeleyEntryConverter."""
+        for (name, count) in counters.items():
+            self.values[name] = self.values.get(name, 0) + count
+
+    def setRate(self, name, hits, misses):
+        self.values['%s.hits' % name] = hits
+        self.values['%s.misses' % name] = misses
+        self.values['%s.hitRate' % name] = float(hits) / (hits + misses) if hits + misses else None
+
+    def stage(self, name):
+        """Ends the current stage, if any, and starts timing the stage called name; None just ends the current one."""
+        now = time.time()
+        if self.currentStage is not None:
+            self.stages[self.currentStage] = self.stages.get(self.currentStage, 0.0) + now - self.stageStart
+        (self.currentStage, self.stageStart) = (name, now)
+
+    def wrapStream(self, stream):
+        return CountingStream(stream, self)
+
+    def addSQL(self, profiler):
+        """Adds the number of SQL statements and the time spent on them, as recorded by a Profiler."""
+        timings = [timing for (name, timing) in profiler.timings.items() if name.startswith('SQL ')]
+        self.values['sql.statements'] = sum([calls for (calls, elapsed) in timings])
+        self.values['sql.seconds'] = sum([elapsed for (calls, elapsed) in timings])
+
+    def getValues(self):
+        self.stage(None)
+        values = dict(self.values)
+        values['timestamp'] = self.start
+        for (name, elapsed) in self.stages.items():
+            values['stages.%s' % name] = elapsed
+        values['stages.total'] = time.time() - self.start
+        return values
+
+    def formatJSON(self):
+        report = {}
+        for (name, value) in sorted(self.getValues().items()):
+            parts = name.split('.')
+            node = report
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = value
+        return json.dumps(report, indent=2, sort_keys=True) + '\n'
+
+    def formatPrometheus(self, prefix='mendeley2bib'):
+        lines = []
+        labels = []
+        for (name, value) in sorted(self.getValues().items()):
+            if isinstance(value, str):
+                labels.append('%s="%s"' % (self.getMetricName(name), value.replace('\\', '\\\\').replace('"', '\\"')))
+                continue
+            if value is None:
+                continue
+            if name.startswith('stages.'):
+                lines.append('%s_stage_seconds{stage="%s"} %r' % (prefix, name[len('stages.'):], float(value)))
+            else:
+                lines.append('%s_%s %r' % (prefix, self.getMetricName(name), float(value)))
+        lines.append('%s_info{%s} 1' % (prefix, ','.join(labels)))
+        return '\n'.join(lines) + '\n'
+
+    def getMetricName(self, name):
+        return re.sub(r'([a-z])([A-Z])', r'\1_\2', name).replace('.', '_').lower()
+
+"""
+Wraps an output stream, counting the number of bytes written to it as UTF-8.
+"""
+class CountingStream:
+    def __init__(self, stream, report):
+        self.stream = stream
+        self.report = report
+        report.values.setdefault('output.bytes', 0)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def write(self, data):
+        self.report.values['output.bytes'] += len(data) if data.isascii() else len(data.encode('utf-8'))
+        return self.stream.write(data)